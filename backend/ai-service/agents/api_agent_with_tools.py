@@ -1,57 +1,48 @@
 import logging
-import random
-from abc import ABC
-from os import getenv
-from typing import Literal
+import time
+from typing import Dict, Any, List
 import json
-import requests
-from requests.exceptions import RequestException, Timeout, ConnectionError
 
-from langchain.agents import Agent
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import tool
 
 from agents.base_agent import BaseAgent, AgentState
+from util.context_manager import ContextManager
+from util.http_client import get_http_client
+from util.llm_scheduler import LlmOverloaded
+from util.lookup_cache import LookupCache, caller_key
+from util.metrics import ERRORS
+from util.single_flight import SingleFlight
+from util.tool_executor import ToolExecutor
 
 
 logger = logging.getLogger(__name__)
-@tool
-def get_claim_details(claim_id: str, token: str = None) -> dict:
-    """Get claim details from given claim id
-    :param claim_id: claim id
-    :return: claim details
-    """
-    # Validate claim ID format
-    claim_id = claim_id.strip()
-    if not claim_id.isdigit():
-        return {"error": f"Invalid claim ID format: {claim_id}. Claim ID must be numeric"}
-    if len(claim_id) < 5 or len(claim_id) > 10:
-        return {"error": f"Invalid claim ID length: {claim_id}. Claim ID must be between 4-10 digits"}
-    
-    try:
-        # Make API call to get claim details
-        api = getenv("EXTERNAL_API_BASE_URL")+"/api/claim/claim-status"
-        headers = {"Content-Type": "application/json"}
+lookup_cache = LookupCache()
+# concurrent identical lookups share one backend request
+claim_lookups = SingleFlight("get_claim_details", copy_result=True)
+policy_lookups = SingleFlight("get_user_policy_details", copy_result=True)
 
-        if token:
-            headers['Authorization'] = f"Bearer {token}"
 
+async def _fetch_claim_details(claim_id: str, token: str = None) -> dict:
+    try:
         payload = {
             "claim_id": int(claim_id)
         }
 
-        # Prepare headers
-        if token:
-            headers['Authorization'] = f"Bearer {token}"
-        response = requests.post(
-            api,
+        # claim-status is a read only lookup, safe to retry even though it is a POST
+        started = time.perf_counter()
+        response = await get_http_client().post(
+            "/api/claim/claim-status",
+            token=token,
             json=payload,
-            headers=headers,
+            idempotent=True,
         )
         
         if response.status_code == 200:
-            return response.json()
+            result = response.json()
+            lookup_cache.put("get_claim_details", token, result, time.perf_counter() - started, claim_id=claim_id)
+            return result
         elif response.status_code == 404:
             return {"error": f"Claim {claim_id} not found"}
         else:
@@ -62,34 +53,54 @@ def get_claim_details(claim_id: str, token: str = None) -> dict:
 
 
 @tool
-def get_user_policy_details(token: str = None) -> dict:
-    """Get user's policy details from given
-    :return: Policy details
+async def get_claim_details(claim_id: str, token: str = None) -> dict:
+    """Get claim details from given claim id
+    :param claim_id: claim id
+    :return: claim details
     """
+    # Validate claim ID format
+    claim_id = claim_id.strip()
+    if not claim_id.isdigit():
+        return {"error": f"Invalid claim ID format: {claim_id}. Claim ID must be numeric"}
+    if len(claim_id) < 5 or len(claim_id) > 10:
+        return {"error": f"Invalid claim ID length: {claim_id}. Claim ID must be between 4-10 digits"}
+    
+    cached = lookup_cache.get("get_claim_details", token, claim_id=claim_id)
+    if cached is not None:
+        return cached
+
+    # only calls made with the same token are shared, the backend authorizes each caller separately
+    return await claim_lookups.run((caller_key(token or ""), claim_id), lambda: _fetch_claim_details(claim_id, token))
+
+
+async def _fetch_user_policy_details(token: str = None) -> dict:
     try:
-        # Make API call to get claim details
-        api = getenv("EXTERNAL_API_BASE_URL") + "/api/policy/user"
-        headers = {"Content-Type": "application/json"}
-
-        if token:
-            headers['Authorization'] = f"Bearer {token}"
-
-        # Prepare headers
-        if token:
-            headers['Authorization'] = f"Bearer {token}"
-        response = requests.get(
-            api,
-            headers=headers,
-        )
+        started = time.perf_counter()
+        response = await get_http_client().get("/api/policy/user", token=token)
+        result = response.json()
+        if response.status_code == 200:
+            lookup_cache.put("get_user_policy_details", token, result, time.perf_counter() - started)
 
-        return response.json()
+        return result
 
     except Exception as e:
         return {"error": f"Could not retrieve required data: {str(e)}"}
 
 
 @tool
-def submit_new_claim(policy_id: str, damage_description: str, vehicle: str, token: str = None) -> dict:
+async def get_user_policy_details(token: str = None) -> dict:
+    """Get user's policy details from given
+    :return: Policy details
+    """
+    cached = lookup_cache.get("get_user_policy_details", token)
+    if cached is not None:
+        return cached
+
+    return await policy_lookups.run(caller_key(token or ""), lambda: _fetch_user_policy_details(token))
+
+
+@tool
+async def submit_new_claim(policy_id: str, damage_description: str, vehicle: str, token: str = None) -> dict:
     """This Api is used to submit a new claim,
     :param policy_id: policy id associated with this claim
     :param damage_description: damage description about the vehicle
@@ -111,36 +122,53 @@ def submit_new_claim(policy_id: str, damage_description: str, vehicle: str, toke
     
     try:
         # Prepare request payload
-
-        api = getenv("EXTERNAL_API_BASE_URL")+"/api/claim/create-claim"
-
         payload = {
             "policyNumber": int(policy_id),
             "damage": damage_description.strip(),
             "vehicle": vehicle.strip()
         }
-        
-        # Prepare headers
-        headers = {"Content-Type": "application/json"}
-        if token:
-            headers['Authorization'] = f"Bearer {token}"
-            
-        # Make API call to submit new claim
-        response = requests.post(
-            api,
+
+        # Make API call to submit new claim, never retried since it is not idempotent
+        response = await get_http_client().post(
+            "/api/claim/create-claim",
+            token=token,
             json=payload,
-            headers=headers,
         )
-        logger.info("Submitted new claim request %s", extra={"request": response.json()})
-        return response.json()
+        logger.info(f"Submitted new claim for policy {policy_id}, backend returned {response.status_code}")
+        if response.is_success:
+            # the caller's policy and claim lookups are out of date now, even if the body below fails to parse
+            lookup_cache.invalidate(token)
+        try:
+            return response.json()
+        except ValueError:
+            if response.is_success:
+                return {"status": response.status_code, "message": "Claim submitted"}
+            return {"error": f"API error: {response.status_code} - {response.text}"}
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}"}
 
+
+# tools that change backend state, never run concurrently with each other
+SIDE_EFFECTING_TOOLS = {"submit_new_claim"}
+
+
+def context_key(tool_call: Dict[str, Any], tool_calls: List[Dict[str, Any]]) -> str:
+    """Context key of a tool result, the tool name unless the same tool was called more than once"""
+    if sum(call["name"] == tool_call["name"] for call in tool_calls) == 1:
+        return tool_call["name"]
+    args = ", ".join(f"{k}={v}" for k, v in tool_call["args"].items() if k != "token")
+    return f"{tool_call['name']}({args})"
+
+
 class ApiToolAgent(BaseAgent):
-    def __init__(self, **kwargs):
+    def __init__(self, summarize_results: bool = False, **kwargs):
         super().__init__(**kwargs)
         self.tools = [get_claim_details,submit_new_claim,get_user_policy_details]
-        self.llm = self.llm.bind_tools(self.tools)
+        self.tool_executor = ToolExecutor(self.tools, side_effecting=SIDE_EFFECTING_TOOLS)
+        # when set, tool results are turned into the final answer here instead of by the fallback node
+        self.summarize_results = summarize_results
+        self._summary_llm = None
+        self.context_manager = ContextManager()
 
         self.api_prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an API interaction agent for an insurance system.
@@ -165,7 +193,40 @@ class ApiToolAgent(BaseAgent):
                     """),
             ("human", "{query}")
         ])
+        self.summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a helpful insurance customer service assistant.
+                    Present the API results below to the user in a clear, human-readable way
+                    without losing any details. If a result contains an error, explain it and
+                    suggest what the user can do next.
 
+                    User Request: {query}
+                    API Results: {results}"""),
+            ("human", "{query}")
+        ])
+
+
+    @property
+    def summary_llm(self):
+        if self._summary_llm is None:
+            self._summary_llm = super()._create_llm()
+        return self._summary_llm
+
+    @summary_llm.setter
+    def summary_llm(self, llm):
+        self._summary_llm = llm
+
+    def _create_llm(self):
+        return self.summary_llm.bind_tools(self.tools)
+
+    async def _summarize(self, state: AgentState, user_message: str, results: Dict[str, Any]):
+        """Render tool results as the final answer with a single LLM call"""
+        response = await self.summary_llm.ainvoke(
+            self.summary_prompt.format_messages(
+                query=user_message,
+                results=json.dumps(results, default=str)
+            )
+        )
+        state["messages"].append(AIMessage(content=response.content))
 
     async def process(self, state: AgentState) -> AgentState:
         """Process API requests using tool calling"""
@@ -183,58 +244,69 @@ class ApiToolAgent(BaseAgent):
                 state["error"] = "No user message found for API interaction"
                 return state
 
-            # Use the API prompt to process the message with context
-            formatted_messages = self.api_prompt.format_messages(
-                query=user_message,
-                context=json.dumps(state["context"], default=str)
-            )
-            
-            # Let LLM with tools process the formatted message
-            response = await self.llm.ainvoke(formatted_messages)
+            if state.get("pending_action", False):
+                # the user is answering a confirmation, the tools to run are already decided
+                response = AIMessage(content="")
+                user_message = next(
+                    (msg.content for msg in reversed(state["messages"][:-1]) if isinstance(msg, HumanMessage)),
+                    user_message
+                )
+            else:
+                # Use the API prompt to process the message with context
+                formatted_messages = self.api_prompt.format_messages(
+                    query=user_message,
+                    context=self.context_manager.render(state["context"], "api")
+                )
+
+                # Let LLM with tools process the formatted message
+                response = await self.llm.ainvoke(formatted_messages)
 
             # Handle tool calls if any
             if hasattr(response, 'tool_calls') and response.tool_calls or state.get("pending_action",False):
                 # Execute tool calls
-                tool_calls = response.tool_calls or state.get("pending_action").get("api")
+                tool_calls = (state.get("pending_action") or {}).get("api") or response.tool_calls
                 if tool_calls[0].get("confirmed") is None:
                     state["current_step"] = "confirmation_needed"
                     state["pending_action"] = {"api": response.tool_calls}
-                    state["messages"].append(AIMessage("Please confirm your entered details yes/no"))
+                    if self.summarize_results:
+                        # no fallback pass will explain what is being confirmed, so spell it out
+                        details = "\n".join(
+                            f"- {call['name']}: " + ", ".join(f"{k}={v}" for k, v in call["args"].items() if k != "token")
+                            for call in response.tool_calls
+                        )
+                        state["messages"].append(AIMessage(f"I am about to run:\n{details}\nPlease confirm your entered details yes/no"))
+                    else:
+                        state["messages"].append(AIMessage("Please confirm your entered details yes/no"))
 
                 elif tool_calls[0].get("confirmed"):
-                    for tool_call in tool_calls:
-                        tool_name = tool_call["name"]
-                        tool_args = tool_call["args"]
-
-                        # Add token from state to tool arguments if available
-                        tool_args["token"] = state["token"]
-
-                        # Find and execute the tool
-                        for tool in self.tools:
-                            if tool.name == tool_name:
-                                try:
-                                    tool_result = tool.invoke(tool_args)
-                                    # Update response with tool result
-                                    state["context"][tool_name] = tool_result
-                                    # response.content += f"\n\nBased on the claim lookup: {tool_result}"
-                                    state["current_step"] = "api_completed"
-                                except Exception as e:
-                                    logger.error(f"Tool execution error: {e}")
-                                    response.content += f"\n\nError retrieving claim details: {str(e)}"
+                    def store_result(tool_call, tool_result):
+                        # each result lands in the context as soon as its call returns
+                        state["context"][context_key(tool_call, tool_calls)] = tool_result
+                        state["current_step"] = "api_completed"
+
+                    await self.tool_executor.run(tool_calls, store_result, token=state["token"])
                     state["pending_action"] = {}
+                    if self.summarize_results:
+                        await self._summarize(state, user_message, {
+                            key: state["context"].get(key) for key in (context_key(call, tool_calls) for call in tool_calls)
+                        })
                 else:
                     state["pending_action"] = {}
                     state["current_step"] = "api_completed"
                     state["messages"].append(AIMessage("Thank you for the confirmation,Your request has discarded successfully"))
             else:
-            # Add response to messages
+            # Add response to messages, tagged so the router knows the user is answering this agent
+                response.name = self.name
                 state["messages"].append(response)
                 state["current_step"] = "api_processing"
 
             logger.info(f"API tool processing completed for session {state['session_id']}")
 
+        except LlmOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error in ApiToolAgent: {e}")
+            ERRORS.labels(component="api_agent").inc()
             state["error"] = f"API tool interaction failed: {str(e)}"
 
         return state
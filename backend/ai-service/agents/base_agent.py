@@ -1,5 +1,4 @@
 from abc import ABC, abstractmethod
-from os import getenv
 from typing import Dict, Any, List, Optional, Annotated, TypedDict
 
 from dotenv import load_dotenv
@@ -8,6 +7,8 @@ from langgraph.graph import add_messages
 from langchain_core.messages import BaseMessage, AnyMessage
 import logging
 
+from util.clients import get_chat_model
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,13 +30,22 @@ class BaseAgent(ABC):
 
     def __init__(self, llm: Optional[ChatOpenAI] = None):
         load_dotenv()
-        self.llm = ChatOpenAI(
-            # api_key=getenv("OPENROUTER_API_KEY"),
-            # base_url=getenv("OPENROUTER_BASE_URL"),
-            model=getenv("MODEL_NAME"),
-            temperature=0.8
-        )
         self.name = self.__class__.__name__
+        # the shared client is looked up on first use so constructing an agent stays cheap
+        self._llm = llm
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = self._create_llm()
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    def _create_llm(self):
+        return get_chat_model(self.name)
 
     @abstractmethod
     async def process(self, state: AgentState) -> AgentState:
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AnyMessage, HumanMessage, RemoveMessage, SystemMessage, messages_to_dict
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from agents.base_agent import BaseAgent, AgentState
+from util.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ID = "conversation-summary"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+class HistoryManager(BaseAgent):
+    """Keeps AgentState.messages bounded.
+
+    Once a session has more than max_turns user turns, everything but the last keep_turns turns is
+    folded into a single running summary message at the start of the history. Folding happens in
+    batches so the summary LLM call is only made every few turns, and the orchestrator runs it in the
+    background after the turn's response has been sent. When HISTORY_ARCHIVE_DIR is set
+    the folded messages are appended to a per-session JSONL transcript before they are dropped.
+    """
+
+    def __init__(self, max_turns: Optional[int] = None, keep_turns: Optional[int] = None,
+                 archive_dir: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_turns = max_turns or int(getenv("HISTORY_MAX_TURNS", "12"))
+        self.keep_turns = min(keep_turns or int(getenv("HISTORY_KEEP_TURNS", "6")), self.max_turns)
+        self.archive_dir = archive_dir if archive_dir is not None else getenv("HISTORY_ARCHIVE_DIR", "")
+
+        self.summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You maintain the running summary of a conversation between a customer and an
+            insurance assistant. Update the existing summary with the new messages below.
+            Keep every policy number, claim id, vehicle and damage detail, submitted claim and
+            open question. Drop greetings and small talk. Answer with the updated summary only.
+
+            Existing summary: {summary}
+
+            New messages:
+            {transcript}"""),
+            ("human", "Write the updated summary.")
+        ])
+
+    @staticmethod
+    def _turn_starts(messages: List[AnyMessage]) -> List[int]:
+        return [i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage)]
+
+    @staticmethod
+    def _transcript(messages: List[AnyMessage]) -> str:
+        lines = []
+        for msg in messages:
+            role = "User" if isinstance(msg, HumanMessage) else "Assistant"
+            if msg.content:
+                lines.append(f"{role}: {msg.content}")
+        return "\n".join(lines)
+
+    def _archive(self, session_id: str, messages: List[AnyMessage]):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id) + ".jsonl"
+        with open(os.path.join(self.archive_dir, file_name), "a", encoding="utf-8") as f:
+            for record in messages_to_dict(messages):
+                f.write(json.dumps(record, default=str) + "\n")
+
+    @staticmethod
+    def _split_summary(messages: List[AnyMessage]) -> Tuple[str, List[AnyMessage]]:
+        if messages and messages[0].id == SUMMARY_ID:
+            return messages[0].content[len(SUMMARY_PREFIX):], messages[1:]
+        return "", messages
+
+    def needs_folding(self, messages: List[AnyMessage]) -> bool:
+        return len(self._turn_starts(self._split_summary(messages)[1])) > self.max_turns
+
+    @staticmethod
+    def rebase(update: Dict[str, Any], folded_from: List[AnyMessage], latest: List[AnyMessage]) -> Dict[str, Any]:
+        """Carry a fold computed from folded_from over to latest, keeping the messages added since.
+        Empty when latest no longer starts with folded_from, e.g. it was folded elsewhere"""
+        if [msg.id for msg in latest[:len(folded_from)]] != [msg.id for msg in folded_from]:
+            return {}
+        return {"messages": [*update["messages"], *latest[len(folded_from):]]}
+
+    async def process(self, state: AgentState) -> Dict[str, Any]:
+        """Return the messages update that folds old turns into the summary, empty when within the window"""
+        summary, messages = self._split_summary(state["messages"])
+        turn_starts = self._turn_starts(messages)
+        if len(turn_starts) <= self.max_turns:
+            return {}
+
+        cut = turn_starts[-self.keep_turns]
+        folded, kept = messages[:cut], messages[cut:]
+        try:
+            response = await self.llm.ainvoke(
+                self.summary_prompt.format_messages(
+                    summary=summary or "(none)",
+                    transcript=self._transcript(folded)
+                )
+            )
+        except Exception as e:
+            # keep the full history rather than lose turns, folding is retried next turn
+            logger.error(f"Error summarizing conversation history: {e}")
+            ERRORS.labels(component="history").inc()
+            return {}
+
+        if self.archive_dir:
+            try:
+                await asyncio.to_thread(self._archive, state["session_id"], folded)
+            except Exception as e:
+                logger.error(f"Error archiving conversation history: {e}")
+
+        logger.info(f"Folded {len(folded)} messages into the conversation summary for session {state['session_id']}")
+        return {
+            "messages": [
+                RemoveMessage(id=REMOVE_ALL_MESSAGES),
+                SystemMessage(content=SUMMARY_PREFIX + response.content, id=SUMMARY_ID),
+                *kept,
+            ]
+        }
@@ -1,21 +1,39 @@
 import logging
-import os
 from os import getenv
-from typing import List
+from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
 import asyncio
-
-from langchain_openai import OpenAIEmbeddings
-from langchain_postgres import PGVector
+import time
 
 from agents.base_agent import BaseAgent, AgentState
+from util.answer_cache import SemanticAnswerCache
+from util.clients import close_clients, get_embeddings, get_vector_store
+from util.llm_scheduler import LlmOverloaded
+from util.metrics import ERRORS, SPECULATIVE_RETRIEVAL_SAVED_SECONDS, SPECULATIVE_RETRIEVAL_WASTED_SECONDS, \
+    SPECULATIVE_RETRIEVALS, VECTOR_SEARCH_SECONDS
+from util.single_flight import SingleFlight
+from util.tracing import get_tracer
 
 logger = logging.getLogger(__name__ )
 
+class Prefetch:
+    """A retrieval started before the routing decision"""
+
+    def __init__(self, query: str, task: asyncio.Task, started_at: float):
+        self.query = query
+        self.task = task
+        self.started_at = started_at
+        self.finished_at: Optional[float] = None
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self.finished_at = time.perf_counter()
+
+
 class KnowledgeRetrievalAgent(BaseAgent):
     """Agent responsible for retrieving information from the knowledge base"""
 
@@ -23,17 +41,14 @@ class KnowledgeRetrievalAgent(BaseAgent):
         load_dotenv()
         super().__init__(**kwargs)
         self.api_key = getenv("OPENROUTER_API_KEY")
-        self.embeddings = OpenAIEmbeddings()
-
-        collection_name = "policy_documents"
-        database_url = os.getenv("KNOWLEDGE_DB_URL")
-
-        self.vector_store = PGVector(
-            embeddings=OpenAIEmbeddings(),
-            collection_name=collection_name,
-            connection=database_url,
-            use_jsonb=True,
-        )
+        self.collection_name = "policy_documents"
+        self.retrieval_timeout = float(getenv("RETRIEVAL_TIMEOUT", "3"))
+        self.search_flights = SingleFlight("vector_search")
+        # speculative retrievals started by the orchestrator, by session id
+        self._prefetches: Dict[str, Prefetch] = {}
+        self.answer_cache = None
+        if getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+            self.answer_cache = SemanticAnswerCache(collection_name=self.collection_name)
         self.retrieval_prompt = ChatPromptTemplate.from_messages([
             ("system", """You are a knowledge retrieval agent for an insurance company.
             Your job is to find and present relevant information from the knowledge base.
@@ -67,8 +82,26 @@ class KnowledgeRetrievalAgent(BaseAgent):
                 state["error"] = "No user message found for knowledge retrieval"
                 return state
 
+            started = time.perf_counter()
+            prefetch = self._take_prefetch(state["session_id"], user_message)
+            query_vector = None
+            if self.answer_cache:
+                query_vector = await self._embed_query(user_message)
+                cached = self.answer_cache.lookup(query_vector) if query_vector is not None else None
+                if cached:
+                    if prefetch:
+                        self._discard(prefetch)
+                    state["messages"].append(AIMessage(content=cached.answer))
+                    state["context"]["retrieved_documents"] = cached.retrieved_documents
+                    state["context"]["knowledge_retrieved"] = True
+                    state["current_step"] = "knowledge_retrieved"
+                    return state
+
             # Retrieve relevant documents
-            docs = await self._retrieve_documents(user_message)
+            if prefetch:
+                docs = await self._use(prefetch)
+            else:
+                docs = await self._retrieve_documents(user_message, query_vector=query_vector)
 
             # Format documents for prompt
             formatted_docs = "\n\n".join([
@@ -94,29 +127,121 @@ class KnowledgeRetrievalAgent(BaseAgent):
                 }
                 for doc in docs
             ]
+            # nothing retrieved usually means the store was unavailable, don't pin that answer
+            if self.answer_cache and docs and query_vector is not None:
+                self.answer_cache.store(
+                    query=user_message,
+                    query_vector=query_vector,
+                    answer=response.content,
+                    retrieved_documents=state["context"]["retrieved_documents"],
+                    cost_seconds=time.perf_counter() - started,
+                )
             state["context"]["knowledge_retrieved"] = True
             state["current_step"] = "knowledge_retrieved"
 
             logger.info(f"Knowledge retrieval completed for session {state['session_id']}")
 
+        except LlmOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error in KnowledgeRetrievalAgent: {e}")
+            ERRORS.labels(component="knowledge_agent").inc()
             state["error"] = f"Knowledge retrieval failed: {str(e)}"
 
         return state
 
-    async def _retrieve_documents(self, query: str, k: int = 3) -> List[Document]:
-        """Retrieve relevant documents from vector store"""
+    async def _embed_query(self, query: str) -> Optional[List[float]]:
+        """Query embedding for the answer cache, None when it fails or exceeds retrieval_timeout"""
         try:
-            docs = await asyncio.to_thread(
-                self.vector_store.similarity_search,
-                query,
-                k=k
+            return await asyncio.wait_for(self.embeddings.aembed_query(query), timeout=self.retrieval_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Query embedding timed out after {self.retrieval_timeout}s, skipping the answer cache")
+        except Exception as e:
+            logger.error(f"Error embedding query, skipping the answer cache: {e}")
+            ERRORS.labels(component="vector_search").inc()
+        return None
+
+    async def _retrieve_documents(self, query: str, k: int = 3, query_vector: Optional[List[float]] = None) -> List[Document]:
+        """Retrieve relevant documents from vector store, giving up with no documents after retrieval_timeout"""
+        started = time.perf_counter()
+        outcome = "ok"
+        search_span = get_tracer().start_span("vector_search", k=k, embedded=query_vector is None)
+        try:
+            async def search():
+                vector = query_vector or await self.embeddings.aembed_query(query)
+                return await self.vector_store.asimilarity_search_by_vector(vector, k=k)
+
+            # identical questions in flight at the same time share one search
+            docs = await asyncio.wait_for(
+                self.search_flights.run((self.embeddings.key(query), k), search),
+                timeout=self.retrieval_timeout,
             )
+            search_span.set(documents=len(docs), bytes=sum(len(doc.page_content) for doc in docs))
             return docs
+        except asyncio.CancelledError:
+            # e.g. a speculative retrieval discarded by the router
+            outcome = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning(f"Document retrieval timed out after {self.retrieval_timeout}s, answering without documents")
+            return []
         except Exception as e:
+            outcome = "error"
             logger.error(f"Error retrieving documents: {e}")
+            ERRORS.labels(component="vector_search").inc()
             return []
+        finally:
+            VECTOR_SEARCH_SECONDS.labels(outcome=outcome).observe(time.perf_counter() - started)
+            search_span.end(outcome)
+
+    @property
+    def embeddings(self):
+        return get_embeddings()
+
+    @property
+    def vector_store(self):
+        # built on first search, connecting to the knowledge database is not part of startup
+        return get_vector_store(self.collection_name)
+
+    def prefetch(self, session_id: str, query: str):
+        """Start retrieving documents for query before the route is known, see _take_prefetch"""
+        self.discard_prefetch(session_id)
+        self._prefetches[session_id] = Prefetch(query, asyncio.ensure_future(self._retrieve_documents(query)),
+                                                time.perf_counter())
+
+    def discard_prefetch(self, session_id: str):
+        """Drop the session's speculative retrieval, the turn was not routed to this agent"""
+        prefetch = self._prefetches.pop(session_id, None)
+        if prefetch:
+            self._discard(prefetch)
+
+    def _take_prefetch(self, session_id: str, query: str) -> Optional["Prefetch"]:
+        prefetch = self._prefetches.pop(session_id, None)
+        if prefetch and prefetch.query != query:
+            self._discard(prefetch)
+            return None
+        return prefetch
+
+    @staticmethod
+    def _discard(prefetch: "Prefetch"):
+        prefetch.task.cancel()
+        SPECULATIVE_RETRIEVALS.labels(result="discarded").inc()
+        SPECULATIVE_RETRIEVAL_WASTED_SECONDS.inc((prefetch.finished_at or time.perf_counter()) - prefetch.started_at)
+
+    @staticmethod
+    async def _use(prefetch: "Prefetch") -> List[Document]:
+        needed_at = time.perf_counter()
+        docs = await prefetch.task
+        SPECULATIVE_RETRIEVALS.labels(result="used").inc()
+        # the part of the retrieval that ran before this node needed the documents
+        SPECULATIVE_RETRIEVAL_SAVED_SECONDS.inc(min(prefetch.finished_at or needed_at, needed_at) - prefetch.started_at)
+        return docs
+
+    async def close(self):
+        for session_id in list(self._prefetches):
+            self.discard_prefetch(session_id)
+        await close_clients()
 
     def is_knowledge_query(self, query: str) -> bool:
         """Determine if query requires knowledge base lookup"""
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from os import getenv
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from util.session_recorder import scrub_secrets
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("knowledge", "api", "fallback")
+
+
+class LocalRoutingDecision(BaseModel):
+    """Routing decision made without calling the LLM"""
+    agent: str
+    confidence: float
+    reasoning: str
+
+
+# (route, confidence, pattern) checked in order, first match wins
+ROUTING_RULES: List[Tuple[str, float, re.Pattern]] = [
+    ("fallback", 0.97, re.compile(
+        r"^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks?( you)?|thank you( so much)?|thx|ok(ay)?|"
+        r"cool|great|bye|goodbye|see you)[\s!.,]*$", re.I)),
+    ("api", 0.95, re.compile(r"\b(claim|policy)\s*(id|no\.?|number|#)?\s*:?\s*\d{5,10}\b", re.I)),
+    ("api", 0.92, re.compile(r"^\s*\d{5,10}\s*$")),
+    ("api", 0.92, re.compile(r"\b(status of|track|check)\b.*\bclaims?\b|\bclaims?\b.*\bstatus\b", re.I)),
+    ("api", 0.9, re.compile(r"\b(submit|file|raise|open|make|lodge)\b.*\bclaims?\b", re.I)),
+    # "my deductible/premium/coverage" is as often a general question as a lookup, those go to the LLM
+    ("api", 0.9, re.compile(r"\bmy (policy|policies|claims?)\b", re.I)),
+]
+# general insurance questions that matched none of the customer data rules above. Keyword matches are
+# too coarse to skip the LLM router at the default threshold, they weigh in on the classifier instead
+KNOWLEDGE_HINT_CONFIDENCE = 0.8
+KNOWLEDGE_HINT_PRIOR = 2.0
+
+TOKEN_PATTERN = re.compile(r"[a-z']+|\d+")
+EMAIL_PATTERN = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = ["<num>" if token.isdigit() else token for token in TOKEN_PATTERN.findall(text.lower())]
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def scrub(text: str, max_chars: int = 300) -> str:
+    """Strip credentials, email addresses, ids and numbers before a message is written to the training log"""
+    text = EMAIL_PATTERN.sub("[email]", scrub_secrets(text))
+    return re.sub(r"\d", "0", text)[:max_chars]
+
+
+class NaiveBayesRouteClassifier:
+    """Multinomial naive bayes over unigrams and bigrams, updated online"""
+
+    def __init__(self):
+        self.route_counts: Counter = Counter()
+        self.token_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.route_totals: Counter = Counter()
+        self.vocabulary = set()
+
+    @property
+    def samples(self) -> int:
+        return sum(self.route_counts.values())
+
+    def observe(self, text: str, route: str):
+        tokens = tokenize(text)
+        self.route_counts[route] += 1
+        self.token_counts[route].update(tokens)
+        self.route_totals[route] += len(tokens)
+        self.vocabulary.update(tokens)
+
+    def predict(self, text: str, prior: Optional[Dict[str, float]] = None) -> Optional[Tuple[str, float]]:
+        """Most likely route and its probability, prior multiplies the odds of the routes it names"""
+        tokens = tokenize(text)
+        if not tokens or not self.route_counts:
+            return None
+        vocabulary_size = len(self.vocabulary) + 1
+        log_scores = {}
+        for route, count in self.route_counts.items():
+            score = math.log(count / self.samples * (prior or {}).get(route, 1.0))
+            denominator = self.route_totals[route] + vocabulary_size
+            for token in tokens:
+                score += math.log((self.token_counts[route][token] + 1) / denominator)
+            log_scores[route] = score
+
+        best_log = max(log_scores.values())
+        exp_scores = {route: math.exp(score - best_log) for route, score in log_scores.items()}
+        total = sum(exp_scores.values())
+        route = max(exp_scores, key=exp_scores.get)
+        return route, exp_scores[route] / total
+
+
+class LocalRouter:
+    """Cheap routing tier in front of the LLM router.
+
+    Obvious intents are matched by rules, everything else goes through a classifier trained from
+    routing decisions the LLM router made earlier. A decision is only returned when its confidence
+    reaches the threshold, otherwise the caller falls back to the LLM.
+
+    Decisions are only logged for training when log_path is set. Logged messages are scrubbed and
+    truncated, and the log is rotated at max_log_bytes so loading it at startup stays cheap.
+    """
+
+    def __init__(self, knowledge_hint: Optional[Callable[[str], bool]] = None, log_path: Optional[str] = None,
+                 threshold: Optional[float] = None, min_samples: Optional[int] = None,
+                 max_log_bytes: Optional[int] = None):
+        self.knowledge_hint = knowledge_hint
+        self.log_path = log_path if log_path is not None else getenv("LOCAL_ROUTER_LOG_PATH", "")
+        self.max_log_bytes = max_log_bytes or int(getenv("LOCAL_ROUTER_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+        self.max_message_chars = int(getenv("LOCAL_ROUTER_LOG_MAX_CHARS", "300"))
+        self.threshold = threshold or float(getenv("LOCAL_ROUTER_THRESHOLD", "0.85"))
+        self.min_samples = min_samples or int(getenv("LOCAL_ROUTER_MIN_SAMPLES", "200"))
+        self.classifier = NaiveBayesRouteClassifier()
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.log_path:
+            return
+        # the rotated file first, at most two files of max_log_bytes each
+        for path in (self.log_path + ".1", self.log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("agent") in ROUTES and record.get("message"):
+                        self.classifier.observe(record["message"], record["agent"])
+        logger.info(f"Local router trained on {self.classifier.samples} logged routing decisions")
+
+    def route(self, message: str) -> Optional[LocalRoutingDecision]:
+        hinted = False
+        for agent, confidence, pattern in ROUTING_RULES:
+            if pattern.search(message):
+                if confidence >= self.threshold:
+                    return LocalRoutingDecision(agent=agent, confidence=confidence,
+                                                reasoning=f"Local rule matched: {pattern.pattern[:40]}")
+                break
+        else:
+            hinted = self.knowledge_hint and self.knowledge_hint(message)
+            if hinted and KNOWLEDGE_HINT_CONFIDENCE >= self.threshold:
+                return LocalRoutingDecision(agent="knowledge", confidence=KNOWLEDGE_HINT_CONFIDENCE,
+                                            reasoning="Matched knowledge query keywords")
+
+        with self._lock:
+            if self.classifier.samples < self.min_samples:
+                return None
+            prediction = self.classifier.predict(message, {"knowledge": KNOWLEDGE_HINT_PRIOR} if hinted else None)
+        if prediction and prediction[1] >= self.threshold:
+            return LocalRoutingDecision(agent=prediction[0], confidence=prediction[1],
+                                        reasoning="Local classifier prediction")
+        return None
+
+    def _append(self, line: str):
+        with self._file_lock:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.max_log_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    async def record(self, message: str, agent: str):
+        """Learn from a decision made by the LLM router and append it to the training log"""
+        if agent not in ROUTES:
+            return
+        message = scrub(message, self.max_message_chars)
+        with self._lock:
+            self.classifier.observe(message, agent)
+        if not self.log_path:
+            return
+        try:
+            await asyncio.to_thread(self._append, json.dumps({"message": message, "agent": agent}))
+        except Exception as e:
+            logger.error(f"Error logging routing decision: {e}")
@@ -1,23 +1,35 @@
-import json
+import argparse
+import asyncio
 import logging
+from os import getenv
 from enum import Enum
-from typing import Dict, Any, Literal, TypedDict
+from typing import Dict, Any, Literal, AsyncIterator, Optional
 from pydantic import BaseModel
 
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
 from langgraph.types import Command
-from psycopg import Connection, AsyncConnection
+from psycopg.rows import dict_row
 
 from agents.api_agent_with_tools import ApiToolAgent
 from agents.base_agent import BaseAgent, AgentState
+from agents.history_manager import HistoryManager
 from agents.knowledge_retrieval_agent import KnowledgeRetrievalAgent
+from agents.local_router import LocalRouter
+from util.checkpoint_retention import CheckpointRetention
+from util.context_manager import ContextManager
+from util.db_pool import create_async_pool
+from util.instrumentation import InstrumentedPostgresSaver, StartupTimer, timed_node
+from util.llm_scheduler import LlmOverloaded
+from util.metrics import ERRORS, ROUTING_DECISIONS
+from util.tracing import get_tracer
 
 logger = logging.getLogger(__name__)
 
+GRAPH_NODES = ("orchestrator", "knowledge_retrieval", "api_interaction", "fallback")
+
 class QueryType(Enum):
     KNOWLEDGE = "knowledge"
     API = "api"
@@ -26,6 +38,20 @@ class QueryType(Enum):
     CONFIRMATION = "confirmation"
 
 
+class GraphMode(Enum):
+    # specialist answers are rephrased by the fallback node (three LLM calls per knowledge/api turn)
+    REPHRASE = "rephrase"
+    # specialist output is the final answer, api tool results are summarized by the api agent itself
+    SINGLE = "single"
+
+
+# nodes whose LLM output is shown to the user as the turn's answer
+ANSWER_NODES = {
+    GraphMode.REPHRASE: ("api_interaction", "fallback"),
+    GraphMode.SINGLE: ("knowledge_retrieval", "api_interaction", "fallback"),
+}
+
+
 class RoutingDecision(BaseModel):
     """Model for LLM routing decisions"""
     agent: Literal["knowledge", "api", "fallback"] = "fallback"
@@ -33,18 +59,31 @@ class RoutingDecision(BaseModel):
 
 
 class OrchestratorAgentNew(BaseAgent):
-    def __init__(self,database_url,api_base_url, **kwargs):
+    def __init__(self,database_url,api_base_url, graph_mode: Optional[str] = None, checkpointer=None, **kwargs):
         super().__init__(**kwargs)
-
-        self.api_tool_agent = ApiToolAgent()  # Initialize the tool-based API agent
+        self.graph_mode = GraphMode(graph_mode or getenv("GRAPH_MODE", GraphMode.REPHRASE.value))
+        single_generation = self.graph_mode == GraphMode.SINGLE
 
         self.database_url = database_url
         self.api_base_url = api_base_url
         self.knowledge_agent = KnowledgeRetrievalAgent(database_url)
-        self.api_agent = ApiToolAgent()
+        self.api_agent = ApiToolAgent(summarize_results=single_generation)
+        logger.info(f"Orchestrator running in {self.graph_mode.value} graph mode")
+        self.context_manager = ContextManager()
+        self.history_manager = HistoryManager()
+        # history folds running after a session's last response, the next turn waits for its fold
+        self._history_folds: Dict[str, asyncio.Task] = {}
+        # start knowledge retrieval in parallel with the routing LLM call
+        self.speculative_retrieval = getenv("SPECULATIVE_RETRIEVAL_ENABLED", "false").lower() == "true"
+        self.local_router = None
+        if getenv("LOCAL_ROUTER_ENABLED", "true").lower() == "true":
+            self.local_router = LocalRouter(knowledge_hint=self.knowledge_agent.is_knowledge_query)
 
         # Initialize agents
-        self.checkpointer = None
+        # a preset checkpointer (e.g. in-memory for benchmarks) skips the Postgres pool
+        self.checkpointer = checkpointer
+        self.db_pool = None
+        self.retention = None
         # Build the graph
         self.graph = None
         # self.graph = self._build_graph()
@@ -98,66 +137,74 @@ class OrchestratorAgentNew(BaseAgent):
             ("human", "{message}")
         ])
 
-    async def initialize(self):
+    def _build_graph(self) -> StateGraph:
         graph_builder = StateGraph(AgentState)
-        connection_kwargs = {
-            "autocommit": True,
-            "prepare_threshold": 0,
-        }
-
-        db_connection = await AsyncConnection.connect(
-            self.database_url,
-            **connection_kwargs
-        )
-        checkpointer = AsyncPostgresSaver(db_connection)
-        # Setup checkpointer tables
-        await checkpointer.setup()
 
         # graph_builder.add_node("ChatNode", ChatNode)
-        graph_builder.add_node("orchestrator", self._orchestrator_node)
-        graph_builder.add_node("knowledge_retrieval", self._knowledge_node)
-        graph_builder.add_node("api_interaction", self._api_node)
-        graph_builder.add_node("fallback", self._handle_general_query)
+        graph_builder.add_node("orchestrator", timed_node("orchestrator", self._orchestrator_node))
+        graph_builder.add_node("knowledge_retrieval", timed_node("knowledge_retrieval", self._knowledge_node))
+        graph_builder.add_node("api_interaction", timed_node("api_interaction", self._api_node))
+        graph_builder.add_node("fallback", timed_node("fallback", self._handle_general_query))
+        graph_builder.add_node("end_turn", timed_node("end_turn", self._end_turn_node))
 
         graph_builder.add_edge(START, "orchestrator")
 
         graph_builder.add_conditional_edges(
             "orchestrator",
-            self._route_decision,
+            # routing runs as part of the orchestrator step, timed separately since it may call the LLM
+            timed_node("route_decision", self._route_decision),
             {
                 "knowledge": "knowledge_retrieval",
                 "api": "api_interaction",
                 "fallback": "fallback",
-                "end": END
+                "end": "end_turn"
             }
         )
+        graph_builder.add_edge("end_turn", END)
 
         graph_builder.add_edge("fallback", 'orchestrator')
         graph_builder.add_edge("knowledge_retrieval", 'orchestrator')
         graph_builder.add_edge("api_interaction", 'orchestrator')
+        return graph_builder
 
-        # self.graph = graph_builder.compile(checkpointer=MemorySaver())
-        self.graph = graph_builder.compile(checkpointer=checkpointer)
-
-        try:
-            # Generate the graph visualization
-            graph_png = self.graph.get_graph().draw_mermaid_png()
-
-            # Save to file
-            with open("insurance_agent_graph.png", "wb") as f:
-                f.write(graph_png)
-            logger.info("Graph visualization saved as insurance_agent_graph.png")
-
-            # Also display if in Jupyter environment
-            try:
-                from IPython.display import Image, display
-                display(Image(graph_png))
-            except ImportError:
-                # Not in Jupyter environment, just save the file
-                pass
+    async def initialize(self, startup: Optional[StartupTimer] = None):
+        startup = startup or StartupTimer()
+        connection_kwargs = {
+            "autocommit": True,
+            "prepare_threshold": 0,
+            "row_factory": dict_row,
+        }
 
-        except Exception as e:
-            logger.error(f"Error generating graph visualization: {e}")
+        if self.checkpointer is None:
+            with startup.phase("checkpointer_pool"):
+                # checkpoint reads/writes of concurrent sessions each take their own pooled connection
+                self.db_pool = create_async_pool(
+                    self.database_url,
+                    name="checkpointer",
+                    env_prefix="CHECKPOINT",
+                    **connection_kwargs
+                )
+                await self.db_pool.open(wait=True)
+            checkpointer = InstrumentedPostgresSaver(self.db_pool)
+            self.checkpointer = checkpointer
+            with startup.phase("checkpointer_setup"):
+                # Setup checkpointer tables
+                await checkpointer.setup()
+            if getenv("CHECKPOINT_RETENTION_ENABLED", "false").lower() == "true":
+                self.retention = CheckpointRetention(self.db_pool)
+                self.retention.start()
+
+        with startup.phase("graph_compile"):
+            # self.graph = graph_builder.compile(checkpointer=MemorySaver())
+            self.graph = self._build_graph().compile(checkpointer=self.checkpointer)
+
+    async def close(self):
+        await asyncio.gather(*self._history_folds.values(), return_exceptions=True)
+        if self.retention is not None:
+            await self.retention.stop()
+        await self.knowledge_agent.close()
+        if self.db_pool is not None:
+            await self.db_pool.close()
 
     async def _classify_query(self, state: AgentState) -> Command[Literal["knowledge", "api", "end"]]:
         """LLM-based routing decision"""
@@ -186,7 +233,7 @@ class OrchestratorAgentNew(BaseAgent):
             routing_decision = await llm_with_structure.ainvoke(
                 self.routing_prompt.format_messages(
                     message=user_message,
-                    context=json.dumps(state["context"], default=str)
+                    context=self.context_manager.render(state["context"], "routing")
                 )
             )
 
@@ -202,11 +249,14 @@ class OrchestratorAgentNew(BaseAgent):
 
         except Exception as e:
             logger.error(f"Error in LLM routing: {e}")
+            ERRORS.labels(component="routing").inc()
             # Fallback to end if routing fails
             return Command(goto="end")
 
     async def _orchestrator_node(self, state: AgentState) -> AgentState:
         """Orchestrator node"""
+        # the first turn of a session has no context carried over from end_turn yet
+        state.setdefault("context", {})
         return await self.process(state)
 
     async def _knowledge_node(self, state: AgentState) -> AgentState:
@@ -217,6 +267,46 @@ class OrchestratorAgentNew(BaseAgent):
         """API interaction node"""
         return await self.api_agent.process(state)
 
+    async def _end_turn_node(self, state: AgentState) -> Dict[str, Any]:
+        """Compact the context before it is checkpointed for the next turn, so per-turn cost stays flat
+        however long the session gets. History is folded after the response, see _schedule_history_fold"""
+        # a speculative retrieval the turn never reached the knowledge node for
+        self.knowledge_agent.discard_prefetch(state["session_id"])
+        return {"context": self.context_manager.end_turn(state["context"])}
+
+    async def _fold_history(self, config: Dict[str, Any]):
+        try:
+            snapshot = await self.graph.aget_state(config)
+            update = await self.history_manager.process(snapshot.values)
+            if not update:
+                return
+            # another worker may have checkpointed a turn of the session while the summary was written
+            latest = await self.graph.aget_state(config)
+            if latest.config["configurable"]["checkpoint_id"] != snapshot.config["configurable"]["checkpoint_id"]:
+                update = self.history_manager.rebase(update, snapshot.values["messages"], latest.values["messages"])
+                if not update:
+                    logger.info(f"History of session {config['configurable']['thread_id']} changed while "
+                                f"folding, folding again after the next turn")
+                    return
+            await self.graph.aupdate_state(config, update, as_node="end_turn")
+        except Exception as e:
+            logger.error(f"Error folding conversation history: {e}")
+            ERRORS.labels(component="history").inc()
+
+    def _schedule_history_fold(self, session_id: str, messages):
+        """Fold old turns into the summary in the background, keeping the summary LLM call off the response path"""
+        if session_id in self._history_folds or not self.history_manager.needs_folding(messages):
+            return
+        task = asyncio.create_task(self._fold_history({'configurable': {'thread_id': session_id}}))
+        self._history_folds[session_id] = task
+        task.add_done_callback(lambda _: self._history_folds.pop(session_id, None))
+
+    async def _wait_for_history_fold(self, session_id: str):
+        # the fold rewrites the checkpointed messages, it must finish before the next turn reads them
+        task = self._history_folds.get(session_id)
+        if task is not None:
+            await asyncio.shield(task)
+
     async def process(self, state: AgentState) -> AgentState:
         return state
 
@@ -231,6 +321,9 @@ class OrchestratorAgentNew(BaseAgent):
             # call fallback with api agent / knowledge agent
             if state["current_step"] in ["api_completed", "knowledge_retrieved","confirmation_needed"]:
                 state["current_step"] ="complete"
+                # in single generation mode the specialist already produced the final answer
+                if self.graph_mode == GraphMode.SINGLE:
+                    return "end"
                 return "fallback"
             # Check if conversation is complete
             if state["current_step"] in ["complete", "general_response","api_processing"]:
@@ -257,25 +350,45 @@ class OrchestratorAgentNew(BaseAgent):
             
             if not user_message:
                 return "end"
-            
-            # Use LLM with structured output for routing
-            llm_with_structure = self.llm.with_structured_output(RoutingDecision)
-            
-            routing_decision = await llm_with_structure.ainvoke(
-                self.routing_prompt.format_messages(
-                    message=state["messages"],
-                    context=json.dumps(state["context"], default=str)
+
+            # Obvious intents are routed locally, saving the routing LLM round trip
+            local_decision = None
+            if self.local_router and self._is_fresh_user_turn(state):
+                local_decision = self.local_router.route(user_message)
+
+            if local_decision:
+                routing_decision = local_decision
+                logger.info(f"Local routing decision: {routing_decision.agent} ({routing_decision.confidence:.2f}) - {routing_decision.reasoning}")
+                ROUTING_DECISIONS.labels(agent=routing_decision.agent, source="local").inc()
+            else:
+                if self.speculative_retrieval and self._is_fresh_user_turn(state):
+                    # retrieval has no side effects, run it while the router decides
+                    self.knowledge_agent.prefetch(state["session_id"], user_message)
+
+                # Use LLM with structured output for routing
+                llm_with_structure = self.llm.with_structured_output(RoutingDecision)
+
+                routing_decision = await llm_with_structure.ainvoke(
+                    self.routing_prompt.format_messages(
+                        message=state["messages"],
+                        context=self.context_manager.render(state["context"], "routing")
+                    )
                 )
-            )
-            
-            logger.info(f"LLM routing decision: {routing_decision.agent} - {routing_decision.reasoning}")
-            
+
+                logger.info(f"LLM routing decision: {routing_decision.agent} - {routing_decision.reasoning}")
+                ROUTING_DECISIONS.labels(agent=routing_decision.agent, source="llm").inc()
+                if self.local_router and self._is_fresh_user_turn(state):
+                    await self.local_router.record(user_message, routing_decision.agent)
+
             # Update state context with routing decision for transparency
             state["context"]["routing_decision"] = {
                 "agent": routing_decision.agent,
                 "reasoning": routing_decision.reasoning
             }
             
+            if routing_decision.agent != "knowledge":
+                self.knowledge_agent.discard_prefetch(state["session_id"])
+
             # Map to available routes
             if routing_decision.agent == "knowledge":
                 logger.info("Routing to Knowledge agent")
@@ -287,14 +400,28 @@ class OrchestratorAgentNew(BaseAgent):
                 logger.info("Routing Fallback")
                 return "fallback"
         
+        except LlmOverloaded:
+            # shed by the LLM scheduler, the request fails fast instead of degrading
+            self.knowledge_agent.discard_prefetch(state["session_id"])
+            raise
         except Exception as e:
+            self.knowledge_agent.discard_prefetch(state["session_id"])
             logger.error(f"Error in routing decision: {e}")
+            ERRORS.labels(component="routing").inc()
             return "fallback"
 
+    def _is_fresh_user_turn(self, state: AgentState) -> bool:
+        """True when the latest message is a user message that is not a reply to an API agent question"""
+        messages = state["messages"]
+        if not messages or not isinstance(messages[-1], HumanMessage):
+            return False
+        # follow ups to the API agent need the conversation, leave them to the LLM router
+        return len(messages) < 2 or getattr(messages[-2], "name", None) != self.api_agent.name
+
     async def _handle_general_query(self, state ):
         try:
             user_message = state["messages"][-1].content
-            fallback_prompt = self.fallback_prompt.format_messages( message=state["messages"], context=json.dumps(state['context'], default=str) )
+            fallback_prompt = self.fallback_prompt.format_messages( message=state["messages"], context=self.context_manager.render(state["context"], "fallback") )
             response = await self.llm.ainvoke(fallback_prompt)
             # response = await self.llm.ainvoke(state["messages"])
 
@@ -303,20 +430,86 @@ class OrchestratorAgentNew(BaseAgent):
             # state.messages.append(AIMessage(content=response.content))
             state["current_step"] = "general_response"
 
+        except LlmOverloaded:
+            # no canned reply when shed, the request fails fast
+            raise
         except Exception as e:
             logger.error(f"Error in general query handling: {e}")
+            ERRORS.labels(component="fallback").inc()
             state["messages"].append(AIMessage( content="I'm here to help with your insurance needs. You can ask about your policies, check claim status, or submit new claims." ))
 
         return state
 
-    async def process_message(self, message, session_id,token):
-        config = {'configurable':{'thread_id':session_id}}
-        return await self.graph.ainvoke({
+    def _initial_state(self, message, session_id, token) -> Dict[str, Any]:
+        return {
             "messages": [HumanMessage(message)],
             "user_id": "test_user",
             "token": token,
             "session_id": session_id,
             "current_step": "start",
-            "context": {},
+            # no context here, the turn starts from the one end_turn checkpointed for the previous turn
             "error": None
-        }, config=config)
\ No newline at end of file
+        }
+
+    async def process_message(self, message, session_id,token):
+        config = {'configurable':{'thread_id':session_id}}
+        with get_tracer().trace("chat", session_id=session_id, message_chars=len(message)):
+            await self._wait_for_history_fold(session_id)
+            result = await self.graph.ainvoke(self._initial_state(message, session_id, token), config=config)
+        self._schedule_history_fold(session_id, result["messages"])
+        return result
+
+    async def stream_message(self, message, session_id, token) -> AsyncIterator[Dict[str, Any]]:
+        """Run the graph and yield node progress and answer tokens as they are produced"""
+        config = {'configurable': {'thread_id': session_id}}
+        answer_open = False
+
+        with get_tracer().trace("chat_stream", session_id=session_id, message_chars=len(message)):
+            await self._wait_for_history_fold(session_id)
+            async for event in self.graph.astream_events(
+                    self._initial_state(message, session_id, token),
+                    config=config,
+                    version="v2"
+            ):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+
+                if kind in ("on_chain_start", "on_chain_end") and event["name"] in GRAPH_NODES and event["name"] == node:
+                    yield {
+                        "event": "node",
+                        "data": {"node": node, "status": "start" if kind == "on_chain_start" else "end"}
+                    }
+                elif kind == "on_chat_model_stream" and node in ANSWER_NODES[self.graph_mode]:
+                    chunk = event["data"]["chunk"]
+                    # tool call chunks carry no user facing text
+                    if chunk.content and not getattr(chunk, "tool_call_chunks", None):
+                        answer_open = True
+                        yield {"event": "token", "data": {"node": node, "content": chunk.content}}
+                elif kind == "on_chat_model_end" and node in ANSWER_NODES[self.graph_mode] and answer_open:
+                    # a node can run more than once per turn, separate the answers
+                    answer_open = False
+                    yield {"event": "token_end", "data": {"node": node}}
+
+            # static replies (e.g. confirmation prompts) never go through the LLM,
+            # so always finish with the final message from the checkpointed state
+            snapshot = await self.graph.aget_state(config)
+            messages = snapshot.values.get("messages", [])
+            self._schedule_history_fold(session_id, messages)
+            yield {"event": "message", "data": {"message": messages[-1].content if messages else ""}}
+
+
+if __name__ == "__main__":
+    # graph visualization, kept out of startup since rendering a PNG calls the mermaid.ink web service
+    parser = argparse.ArgumentParser(description="Render the orchestrator graph")
+    parser.add_argument("--output", default="insurance_agent_graph.png",
+                        help="a .png is rendered by mermaid.ink, any other extension gets the mermaid source")
+    arguments = parser.parse_args()
+
+    graph = OrchestratorAgentNew(database_url=None, api_base_url=None)._build_graph().compile().get_graph()
+    if arguments.output.endswith(".png"):
+        with open(arguments.output, "wb") as f:
+            f.write(graph.draw_mermaid_png())
+    else:
+        with open(arguments.output, "w", encoding="utf-8") as f:
+            f.write(graph.draw_mermaid())
+    print(f"Graph visualization saved as {arguments.output}")
@@ -1,21 +1,33 @@
 from contextlib import asynccontextmanager
 from os import getenv
 import os
-import io
 import uuid
 import asyncio
+import hashlib
 import sys
+import json
+import time
 import logging
+from typing import Optional
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel
-import pypdf
+from sse_starlette.sse import EventSourceResponse
 
 from agents.orchestrator_agent_new import OrchestratorAgentNew
-from util.pdf_processor import PdfDocumentEmbedder
+from util.clients import warm_up
+from util.context_manager import load_token_encoding_in_background
+from util.http_client import init_http_client, close_http_client
+from util.instrumentation import StartupTimer
+from util.ingestion_jobs import IngestionJobManager, IngestionQueueFull
+from util.llm_scheduler import LlmOverloaded, get_llm_scheduler
+from util.metrics import ERRORS, LLM_SHED
+from util.session_recorder import SessionRecorder
+from util.tracing import shutdown_tracer
 
 # Fix asyncio event loop policy for Windows
 if sys.platform == 'win32':
@@ -31,17 +43,40 @@ logging.basicConfig(
         logging.StreamHandler(sys.stdout),
     ]
 )
+logger = logging.getLogger(__name__)
 
-agent_graph = OrchestratorAgentNew(
-    database_url=getenv("DB_URL"),
-    api_base_url=getenv("EXTERNAL_API_BASE_URL")
-)
+startup = StartupTimer()
+with startup.phase("agent_construction"):
+    agent_graph = OrchestratorAgentNew(
+        database_url=getenv("DB_URL"),
+        api_base_url=getenv("EXTERNAL_API_BASE_URL")
+    )
+ingestion_jobs = IngestionJobManager(collection_name="policy_documents")
+session_recorder = SessionRecorder()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     #initialize agent since async postgres connection is using
-    await agent_graph.initialize()
+    await agent_graph.initialize(startup)
+    with startup.phase("http_client"):
+        await init_http_client()
+    # tiktoken may have to download its encoding, token counts are estimated until it is loaded
+    token_encoding = asyncio.create_task(load_token_encoding_in_background())
+    with startup.phase("ingestion_jobs"):
+        await ingestion_jobs.start()
+    startup.report()
+    warmup = None
+    if getenv("CLIENT_WARMUP", "true").lower() == "true":
+        # OpenAI and vector store clients are built lazily, build them now without delaying startup
+        warmup = asyncio.create_task(asyncio.to_thread(warm_up))
     yield
+    if warmup is not None:
+        await warmup
+    token_encoding.cancel()
+    await ingestion_jobs.stop()
+    await close_http_client()
+    await agent_graph.close()
+    shutdown_tracer()
 
 app = FastAPI(lifespan=lifespan)
 class ChatRequest(BaseModel):
@@ -51,18 +86,71 @@ class ChatRequest(BaseModel):
     sessionId: str
     message: str
 
-@app.post("/chat")
-async def chat(req: ChatRequest):
-    result = await agent_graph.process_message(
-        message=req.message,
-        token= req.token,
-        session_id=req.sessionId,
+def overloaded(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="The assistant is handling too many requests right now, please try again shortly",
+        headers={"Retry-After": str(max(1, round(retry_after)))},
     )
-    return {"message": result["messages"][-1].content}
 
-@app.post("/upload-document")
-async def upload_document(file: UploadFile):
-    print(file.filename)
+def admit_chat_request():
+    """Turn a request away up front when the LLM queue is already full, before it adds to the queue"""
+    scheduler = get_llm_scheduler()
+    if scheduler.overloaded():
+        LLM_SHED.labels(reason="admission").inc()
+        raise overloaded(scheduler.queue_timeout)
+
+@app.post("/chat")
+async def chat(req: ChatRequest):
+    admit_chat_request()
+    started_at, started = time.time(), time.perf_counter()
+    status = "error"
+    try:
+        result = await agent_graph.process_message(
+            message=req.message,
+            token= req.token,
+            session_id=req.sessionId,
+        )
+        status = "ok"
+        return {"message": result["messages"][-1].content}
+    except LlmOverloaded as e:
+        status = "shed"
+        raise overloaded(e.retry_after)
+    finally:
+        await session_recorder.record("/chat", req.sessionId, req.userId, req.role, req.message,
+                                      started_at, time.perf_counter() - started, status)
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    admit_chat_request()
+
+    async def event_generator():
+        started_at, started = time.time(), time.perf_counter()
+        status = "ok"
+        try:
+            async for event in agent_graph.stream_message(
+                message=req.message,
+                token=req.token,
+                session_id=req.sessionId,
+            ):
+                yield {"event": event["event"], "data": json.dumps(event["data"])}
+        except LlmOverloaded as e:
+            status = "shed"
+            yield {"event": "error", "data": json.dumps({"detail": str(e), "retry_after": e.retry_after})}
+        except Exception as e:
+            status = "error"
+            logger.error(f"Error streaming chat response: {e}")
+            ERRORS.labels(component="chat_stream").inc()
+            yield {"event": "error", "data": json.dumps({"detail": str(e)})}
+        finally:
+            await session_recorder.record("/chat/stream", req.sessionId, req.userId, req.role, req.message,
+                                          started_at, time.perf_counter() - started, status)
+
+    return EventSourceResponse(event_generator())
+
+@app.post("/upload-document", status_code=202)
+async def upload_document(file: UploadFile, document_key: Optional[str] = Form(None)):
+    logger.info(f"Received document upload {file.filename}")
     try:
         if file.content_type != "application/pdf":
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -80,28 +168,46 @@ async def upload_document(file: UploadFile):
         file_path = os.path.join(uploads_dir, unique_filename)
 
         # Save file to disk
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        await asyncio.to_thread(_write_file, file_path, file_content)
+        content_hash = (await asyncio.to_thread(hashlib.sha256, file_content)).hexdigest()
 
-        fp = str(file_path)
-        pdf_embedder = PdfDocumentEmbedder(file_path=str(file_path))
-        pdf_embedder.insert_into_db("policy_documents")
+        # re-uploads under the same explicit document key replace the previous version's chunks
+        job = ingestion_jobs.submit(file_path=str(file_path), filename=file.filename, document_key=document_key,
+                                    content_hash=content_hash)
 
-        pdf_reader = pypdf.PdfReader(io.BytesIO(file_content))
-
-        return JSONResponse(content={
+        return JSONResponse(status_code=202, content={
             "success": True,
+            "job_id": job.id,
+            "document_key": job.document_key,
+            "status": job.status,
             "filename": file.filename,
             "content_type": file.content_type,
             "size": len(file_content),
-            "pages": len(pdf_reader.pages),
         })
 
     except HTTPException:
         raise
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
+@app.get("/ingest-jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        # job statuses are kept in memory, only the process that took the upload knows the job
+        raise HTTPException(status_code=404, detail=f"Ingestion job {job_id} not found")
+    return job.model_dump(mode="json")
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def _write_file(file_path: str, content: bytes):
+    with open(file_path, "wb") as f:
+        f.write(content)
+
 if __name__ == "__main__":
     print(f"port {int(getenv("PORT"))}")
     uvicorn.run(app, host="0.0.0.0", port=int(getenv("PORT")))
\ No newline at end of file
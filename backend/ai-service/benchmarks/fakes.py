@@ -0,0 +1,203 @@
+"""Deterministic stand-ins for the OpenAI models and the backend API used by the benchmark"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, Dict, Iterable, List
+
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from util.llm_scheduler import ScheduledChatModel, estimate_prompt_tokens, get_llm_scheduler
+
+CLAIM_ID_PATTERN = re.compile(r"\b\d{5,10}\b")
+ROUTE_KEYWORDS = {
+    "api": ("claim", "my policy", "policy details"),
+    "knowledge": ("cover", "deductible", "what is", "explain"),
+}
+
+
+def route_for(text: str) -> str:
+    """Route of the latest message in a prompt: the keyword that appears last wins"""
+    text = text.lower()
+    best, best_position = "fallback", -1
+    for route, keywords in ROUTE_KEYWORDS.items():
+        for keyword in keywords:
+            position = text.rfind(keyword)
+            if position > best_position:
+                best, best_position = route, position
+    greeting = max(text.rfind("hello"), text.rfind("thank"))
+    return "fallback" if greeting > best_position else best
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with a fixed first-token latency and token rate.
+
+    Routing requests (with_structured_output) are answered by keyword, and when tools are bound
+    the claim/policy tools are called for matching requests, so the real graph takes the same paths
+    it would with OpenAI.
+    """
+    model_name: str = "benchmark-fake"
+    latency: float = 0.2
+    tokens_per_second: float = 200.0
+    completion_tokens: int = 60
+    tool_names: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    @staticmethod
+    def _last_text(messages: List[BaseMessage]) -> str:
+        return str(messages[-1].content) if messages else ""
+
+    def _response(self, messages: List[BaseMessage]) -> AIMessage:
+        text = self._last_text(messages)
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        usage = {"input_tokens": prompt_tokens, "output_tokens": self.completion_tokens,
+                 "total_tokens": prompt_tokens + self.completion_tokens}
+        if self.tool_names:
+            claim_id = CLAIM_ID_PATTERN.search(text)
+            if "claim" in text.lower() and claim_id and "get_claim_details" in self.tool_names:
+                return AIMessage("", tool_calls=[{"name": "get_claim_details", "args": {"claim_id": claim_id.group()},
+                                                  "id": "call_claim"}], usage_metadata=usage)
+            if "policy" in text.lower() and "get_user_policy_details" in self.tool_names:
+                return AIMessage("", tool_calls=[{"name": "get_user_policy_details", "args": {}, "id": "call_policy"}],
+                                 usage_metadata=usage)
+        words = " ".join(f"word{i % 50}" for i in range(self.completion_tokens))
+        return AIMessage(words, usage_metadata=usage)
+
+    def _duration(self) -> float:
+        return self.latency + self.completion_tokens / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._duration())
+        return ChatResult(generations=[ChatGeneration(message=self._response(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._duration())
+        return ChatResult(generations=[ChatGeneration(message=self._response(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        response = self._response(messages)
+        await asyncio.sleep(self.latency)
+        if response.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(response.tool_calls)
+            ]))
+            return
+        for word in response.content.split(" "):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tool_names": [tool.name for tool in tools]})
+
+    def with_structured_output(self, schema, **kwargs):
+        async def decide(prompt_value):
+            messages = prompt_value.to_messages() if hasattr(prompt_value, "to_messages") else prompt_value
+            await self._structured_call(messages)
+            return schema(agent=route_for(self._last_text(messages)), reasoning="benchmark keyword routing")
+
+        return RunnableLambda(decide)
+
+    async def _structured_call(self, messages: List[BaseMessage]):
+        await asyncio.sleep(self.latency)
+
+
+class ScheduledFakeChatModel(ScheduledChatModel, FakeChatModel):
+    """FakeChatModel queued, rate limited and shed by the LLM scheduler like the real chat model"""
+
+    async def _structured_call(self, messages: List[BaseMessage]):
+        async with get_llm_scheduler().slot(self.model_name, estimate_prompt_tokens(messages)):
+            await super()._structured_call(messages)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors, similar texts get similar vectors"""
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = "benchmark-fake"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def stub_api_transport(latency: float = 0.05) -> httpx.MockTransport:
+    """Local stand-in for the NestJS claims/policy API"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        body: Dict[str, Any] = json.loads(request.content) if request.content else {}
+        if request.url.path == "/api/claim/claim-status":
+            return httpx.Response(200, json={"claimId": body.get("claim_id"), "status": "IN_REVIEW",
+                                             "amount": 1250.0, "updatedAt": "2025-01-01T00:00:00Z"})
+        if request.url.path == "/api/policy/user":
+            return httpx.Response(200, json=[{"policyNumber": 1234567, "type": "Comprehensive",
+                                              "vehicle": "Toyota Corolla", "premium": 540.0}])
+        if request.url.path == "/api/claim/create-claim":
+            return httpx.Response(201, json={"claimId": 7654321, "status": "SUBMITTED", **body})
+        return httpx.Response(404, json={"message": "not found"})
+
+    return httpx.MockTransport(handler)
+
+
+def make_pdf(pages: int, lines_per_page: int = 40, seed: int = 0, edited_pages: Iterable[int] = ()) -> bytes:
+    """Minimal text PDF, every document gets different text so nothing is skipped as unchanged.
+
+    Pages listed in edited_pages get amended text, the rest matches the same seed without edits.
+    """
+    topics = ["coverage", "deductible", "premium", "claim", "exclusion", "liability", "collision", "theft"]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None]
+    kids = []
+    font = 3 + pages * 2
+    edited_pages = set(edited_pages)
+    for page in range(pages):
+        amended = " amended" if page in edited_pages else ""
+        lines = " ".join(
+            f"(Section {seed}.{page}.{line}{amended} {topics[(seed + page + line) % len(topics)]} terms apply to insured "
+            f"vehicles under policy schedule {seed * 1000 + page}) '"
+            for line in range(lines_per_page)
+        )
+        content = f"BT /F1 9 Tf 20 820 Td 11 TL {lines} ET"
+        kids.append(f"{len(objects) + 1} 0 R")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents {len(objects) + 2} 0 R "
+                       f"/Resources << /Font << /F1 {font} 0 R >> >> >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
@@ -0,0 +1,127 @@
+"""Replay recorded chat sessions against a running AI service.
+
+Sessions come from a file written with SESSION_RECORD_PATH set. Each session is replayed in its
+recorded order, with the gaps between turns shortened by --speedup, and the latency is reported per
+turn index to show how cost grows as sessions get longer.
+
+    cd backend/ai-service
+    python -m benchmarks.replay_sessions recorded.jsonl --base-url http://localhost:8000 \\
+        --token "$JWT" --speedup 10 --concurrency 20 --output replay.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.run_benchmark import git_commit, summarize
+
+
+def load_sessions(path: str) -> List[List[Dict[str, Any]]]:
+    sessions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                sessions[record["session"]].append(record)
+    ordered = [sorted(turns, key=lambda turn: turn["ts"]) for turns in sessions.values()]
+    return sorted(ordered, key=lambda turns: turns[0]["ts"])
+
+
+async def replay(args) -> Dict[str, Any]:
+    sessions = load_sessions(args.recording)
+    if args.max_sessions:
+        sessions = sessions[:args.max_sessions]
+    first_ts = sessions[0][0]["ts"] if sessions else 0
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: Dict[int, List[float]] = defaultdict(list)
+    errors: Dict[int, int] = defaultdict(int)
+    recorded: Dict[int, List[float]] = defaultdict(list)
+    started = time.perf_counter()
+
+    async def run_session(client: httpx.AsyncClient, turns: List[Dict[str, Any]]):
+        # keep the recorded arrival pattern of sessions, scaled by the speedup
+        delay = (turns[0]["ts"] - first_ts) / args.speedup - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            # fresh ids so replayed sessions never continue a recorded conversation
+            session_id = f"replay-{run_id}-{turns[0]['session']}"
+            previous_ts = turns[0]["ts"]
+            for index, turn in enumerate(turns):
+                think_time = (turn["ts"] - previous_ts) / args.speedup
+                previous_ts = turn["ts"]
+                if index and think_time > 0:
+                    await asyncio.sleep(min(think_time, args.max_think_time))
+                request_started = time.perf_counter()
+                try:
+                    response = await client.post(turn.get("endpoint", "/chat"), json={
+                        "userId": turn.get("user", "replay"),
+                        "role": turn.get("role", "user"),
+                        "token": args.token,
+                        "sessionId": session_id,
+                        "message": turn["message"],
+                    })
+                    if turn.get("endpoint") == "/chat/stream":
+                        # the turn is over once the stream is fully read
+                        await response.aread()
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[index].append(time.perf_counter() - request_started)
+                else:
+                    errors[index] += 1
+                if turn.get("latency_ms") is not None:
+                    recorded[index].append(turn["latency_ms"] / 1000)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        await asyncio.gather(*[run_session(client, turns) for turns in sessions])
+    elapsed = time.perf_counter() - started
+
+    turn_indexes = sorted(set(latencies) | set(errors))
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("token", "output")},
+        "sessions": len(sessions),
+        "seconds": round(elapsed, 3),
+        "overall": summarize(all_latencies, sum(errors.values()), elapsed),
+        "turns": {
+            str(index): {
+                **summarize(latencies[index], errors[index], elapsed),
+                "recorded_p50_ms": summarize(recorded[index], 0, elapsed)["p50_ms"] if recorded[index] else None,
+            }
+            for index in turn_indexes
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded chat sessions against a running AI service")
+    parser.add_argument("recording", help="JSONL file written with SESSION_RECORD_PATH")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", default=os.getenv("REPLAY_TOKEN", ""),
+                        help="auth token sent with every request, recordings never contain one")
+    parser.add_argument("--speedup", type=float, default=1.0, help="divide recorded gaps by this factor")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions replayed at once")
+    parser.add_argument("--max-think-time", type=float, default=30.0, help="cap on the pause between turns")
+    parser.add_argument("--max-sessions", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="replay-results.json")
+    arguments = parser.parse_args()
+
+    results = asyncio.run(replay(arguments))
+    with open(arguments.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({"overall": results["overall"], "turns": results["turns"]}, indent=2))
+    print(f"Results written to {arguments.output}")
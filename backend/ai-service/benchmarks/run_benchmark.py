@@ -0,0 +1,261 @@
+"""Offline benchmark of the chat and ingestion paths.
+
+Runs the real FastAPI app and OrchestratorAgentNew graph in process with a fake LLM, fake embeddings,
+a stubbed backend API and an in-memory checkpointer (or Postgres with --database-url), then writes
+latency percentiles per route and ingestion throughput to a JSON file.
+
+    cd backend/ai-service
+    python -m benchmarks.run_benchmark --sessions 200 --concurrency 16 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# (route label, message) turns of each session type
+SESSION_TYPES = {
+    "knowledge": [("knowledge", "What is covered by comprehensive insurance for flood damage?")],
+    "api": [("api", "What is the status of claim 1234567?"), ("api_confirm", "yes")],
+    "policy": [("api", "Show my policy details"), ("api_confirm", "yes")],
+    "fallback": [("fallback", "hello")],
+}
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    values = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(values, 50)), 2) if len(values) else None,
+        "p95_ms": round(float(np.percentile(values, 95)), 2) if len(values) else None,
+        "p99_ms": round(float(np.percentile(values, 99)), 2) if len(values) else None,
+        "mean_ms": round(float(values.mean()), 2) if len(values) else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SESSION_TYPES:
+            raise ValueError(f"Unknown session type {name}, expected one of {', '.join(SESSION_TYPES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def configure_environment(args, workdir: str):
+    """Everything the app reads at import time, set before it is imported"""
+    os.environ.update({
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "benchmark",
+        "MODEL_NAME": os.environ.get("MODEL_NAME") or "gpt-4o",
+        "EXTERNAL_API_BASE_URL": "http://backend.benchmark",
+        "VECTOR_STORE_BACKEND": "local",
+        "LOCAL_VECTOR_INDEX_DIR": os.path.join(workdir, "vector_index"),
+        "EMBEDDING_CACHE_PATH": "",
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        # every benchmark session uses the same token, so cached lookups would hit on every turn
+        "LOOKUP_CACHE_ENABLED": "true" if args.lookup_cache else "false",
+        "LOCAL_ROUTER_ENABLED": "true" if args.local_router else "false",
+        "SPECULATIVE_RETRIEVAL_ENABLED": "true" if args.speculative_retrieval else "false",
+        "LOCAL_ROUTER_LOG_PATH": "",
+        "GRAPH_MODE": args.graph_mode,
+        "HISTORY_ARCHIVE_DIR": "",
+        "TRACE_SAMPLE_RATE": "0",
+        "CHECKPOINT_RETENTION_ENABLED": "false",
+        "CLIENT_WARMUP": "false",
+    })
+    if args.database_url:
+        os.environ["DB_URL"] = args.database_url
+
+
+def install_fakes(app_module, args):
+    from agents.base_agent import BaseAgent
+    from benchmarks.fakes import FakeEmbeddings, ScheduledFakeChatModel
+    from util import embedding_cache
+
+    embedding_cache._cached_embeddings = embedding_cache.CachedEmbeddings(
+        embeddings=FakeEmbeddings(latency=args.embedding_latency),
+        model_name="benchmark-fake",
+        max_memory_entries=10000,
+        disk_path=None,
+    )
+    # scheduled like the real model, so the LLM_* concurrency and queue settings apply here too
+    fake = ScheduledFakeChatModel(latency=args.llm_latency, tokens_per_second=args.token_rate,
+                                  completion_tokens=args.completion_tokens)
+    graph = app_module.agent_graph
+    agents = [graph] + [value for value in vars(graph).values() if isinstance(value, BaseAgent)]
+    for agent in agents:
+        if hasattr(agent, "tools"):
+            agent.summary_llm = fake
+            agent.llm = fake.bind_tools(agent.tools)
+        else:
+            agent.llm = fake
+    if not args.database_url:
+        from langgraph.checkpoint.memory import InMemorySaver
+        graph.checkpointer = InMemorySaver()
+
+
+async def run_ingestion(client, args) -> Dict[str, Any]:
+    from benchmarks.fakes import make_pdf
+
+    started = time.perf_counter()
+    job_ids = []
+    for i in range(args.documents):
+        response = await client.post(
+            "/upload-document",
+            files={"file": (f"benchmark-{i}.pdf", make_pdf(args.pages, seed=i), "application/pdf")},
+            data={"document_key": f"benchmark-{i}"},
+        )
+        response.raise_for_status()
+        job_ids.append(response.json()["job_id"])
+
+    jobs = {}
+    while len(jobs) < len(job_ids):
+        await asyncio.sleep(0.05)
+        for job_id in job_ids:
+            if job_id not in jobs:
+                job = (await client.get(f"/ingest-jobs/{job_id}")).json()
+                if job["status"] in ("completed", "failed"):
+                    jobs[job_id] = job
+    elapsed = time.perf_counter() - started
+
+    pages = sum(job["pages_parsed"] for job in jobs.values())
+    chunks = sum(job["chunks_embedded"] for job in jobs.values())
+    return {
+        "documents": len(job_ids),
+        "failed": sum(1 for job in jobs.values() if job["status"] == "failed"),
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 2),
+        "chunks_per_second": round(chunks / elapsed, 2),
+    }
+
+
+async def run_chat(client, args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    sessions = [rng.choices(names, weights=[mix[name] for name in names])[0]
+                for _ in range(args.warmup + args.sessions)]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_session(index: int, session_type: str):
+        async with semaphore:
+            session_id = f"bench-{uuid.uuid4().hex}"
+            for route, message in SESSION_TYPES[session_type]:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json={
+                        "userId": "benchmark", "role": "user", "token": "benchmark-token",
+                        "sessionId": session_id, "message": message,
+                    })
+                    ok = response.status_code == 200
+                except Exception:
+                    ok = False
+                if index < args.warmup:
+                    continue
+                if ok:
+                    latencies[route].append(time.perf_counter() - started)
+                else:
+                    errors[route] += 1
+
+    await asyncio.gather(*[run_session(i, name) for i, name in enumerate(sessions[:args.warmup])])
+    started = time.perf_counter()
+    await asyncio.gather(*[run_session(args.warmup + i, name) for i, name in enumerate(sessions[args.warmup:])])
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "sessions": args.sessions,
+        "seconds": round(elapsed, 3),
+        "overall": summarize(all_latencies, sum(errors.values()), elapsed),
+        "routes": {route: summarize(latencies[route], errors[route], elapsed)
+                   for route in sorted(set(latencies) | set(errors))},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=SERVICE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="ai-service-benchmark-")
+    configure_environment(args, workdir)
+    # uploads are written relative to the working directory
+    os.chdir(workdir)
+
+    import httpx
+    import app as app_module
+    from util.http_client import init_http_client
+    from benchmarks.fakes import stub_api_transport
+
+    install_fakes(app_module, args)
+    async with app_module.app.router.lifespan_context(app_module.app):
+        await init_http_client("http://backend.benchmark", transport=stub_api_transport(args.api_latency))
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://ai-service.benchmark", timeout=300) as client:
+            ingestion = await run_ingestion(client, args) if args.documents else None
+            chat = await run_chat(client, args) if args.sessions else None
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "database_url")}
+                  | {"checkpointer": "postgres" if args.database_url else "memory"},
+        "ingestion": ingestion,
+        "chat": chat,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline chat and ingestion benchmark for the AI service")
+    parser.add_argument("--sessions", type=int, default=100, help="measured chat sessions")
+    parser.add_argument("--warmup", type=int, default=5, help="sessions run before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions in flight at once")
+    parser.add_argument("--mix", default="knowledge=4,api=2,policy=2,fallback=2",
+                        help=f"weighted session types out of {', '.join(SESSION_TYPES)}")
+    parser.add_argument("--graph-mode", default="rephrase", choices=["rephrase", "single"])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="stub backend API latency")
+    parser.add_argument("--documents", type=int, default=4, help="PDFs uploaded for the ingestion run, 0 skips it")
+    parser.add_argument("--pages", type=int, default=20, help="pages per uploaded PDF")
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--lookup-cache", action="store_true")
+    parser.add_argument("--local-router", action="store_true")
+    parser.add_argument("--speculative-retrieval", action="store_true")
+    parser.add_argument("--database-url", default=None, help="Postgres checkpointer instead of the in-memory one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    arguments = parser.parse_args()
+    output = os.path.abspath(arguments.output)
+
+    results = asyncio.run(main(arguments))
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({"ingestion": results["ingestion"], "chat": (results["chat"] or {}).get("routes")}, indent=2))
+    print(f"Results written to {output}")
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from util import clients, embedding_cache
+
+
+def use_embeddings(monkeypatch, embeddings):
+    monkeypatch.setattr(embedding_cache, "_cached_embeddings", embedding_cache.CachedEmbeddings(
+        embeddings=embeddings, model_name="fake", disk_path=None))
+
+
+@pytest.fixture
+def local_index(tmp_path, monkeypatch):
+    """Local vector index under tmp_path with fake embeddings, returns the index directory"""
+    index_dir = str(tmp_path / "index")
+    monkeypatch.setenv("VECTOR_STORE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_VECTOR_INDEX_DIR", index_dir)
+    monkeypatch.setattr(clients, "_vector_stores", {})
+    use_embeddings(monkeypatch, FakeEmbeddings())
+    return index_dir
+
+
+@pytest.fixture
+def orchestrator(monkeypatch):
+    """Orchestrator on an in-memory checkpointer with fake chat models, call initialize() inside the test's loop"""
+    from langgraph.checkpoint.memory import InMemorySaver
+    from agents.orchestrator_agent_new import OrchestratorAgentNew
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("HISTORY_ARCHIVE_DIR", "")
+    monkeypatch.setenv("LOCAL_ROUTER_ENABLED", "false")
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "false")
+    monkeypatch.setenv("SPECULATIVE_RETRIEVAL_ENABLED", "false")
+    agent = OrchestratorAgentNew(database_url=None, api_base_url=None, checkpointer=InMemorySaver())
+    fake = FakeChatModel(latency=0, completion_tokens=3)
+    for each in (agent, agent.knowledge_agent, agent.history_manager):
+        each.llm = fake
+    agent.api_agent.summary_llm = fake
+    agent.api_agent.llm = fake.bind_tools(agent.api_agent.tools)
+    return agent
@@ -0,0 +1,68 @@
+import asyncio
+import sys
+import types
+
+from benchmarks.fakes import stub_api_transport
+from util import context_manager
+from util.context_manager import ContextManager, count_tokens, load_token_encoding_in_background
+from util.http_client import close_http_client, init_http_client
+
+SESSION = "carry"
+CONFIG = {"configurable": {"thread_id": SESSION}}
+
+
+def test_end_turn_drops_per_turn_data_and_fits_the_carry_budget():
+    context = {
+        "routing_decision": {"agent": "api"},
+        "retrieved_documents": [{"title": "policy", "content": "text"}],
+        "knowledge_retrieved": True,
+        "get_claim_details": {"status": "IN_REVIEW"},
+        "get_user_policy_details": {"policies": ["comprehensive cover " * 200]},
+    }
+
+    carried = ContextManager(carry_budget=100).end_turn(context)
+
+    assert set(carried) == {"get_claim_details", "get_user_policy_details"}
+    assert carried["get_claim_details"] == {"status": "IN_REVIEW"}
+    assert carried["get_user_policy_details"].endswith("...[truncated]")
+
+
+def test_tool_results_are_carried_into_the_next_turn(orchestrator):
+    turns = []
+
+    async def chat():
+        await orchestrator.initialize()
+        await init_http_client("http://backend", transport=stub_api_transport(latency=0))
+        try:
+            for message in ("show my policy details", "yes", "hello again"):
+                await orchestrator.process_message(message, SESSION, "token-1")
+                turns.append((await orchestrator.graph.aget_state(CONFIG)).values["context"])
+        finally:
+            await close_http_client()
+
+    asyncio.run(chat())
+
+    _, confirmed, follow_up = turns
+    assert confirmed["get_user_policy_details"][0]["policyNumber"] == 1234567
+    assert "routing_decision" not in confirmed
+    # the follow up made no lookups, the policy details were carried over
+    assert follow_up == confirmed
+
+
+def test_token_encoding_load_is_retried_until_it_succeeds(monkeypatch):
+    attempts = []
+
+    def encoding_for_model(model):
+        attempts.append(model)
+        if len(attempts) < 3:
+            raise ConnectionError("no network")
+        return types.SimpleNamespace(encode=lambda text: text.split(), decode=" ".join)
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(encoding_for_model=encoding_for_model))
+    monkeypatch.setattr(context_manager, "_token_encoding", None)
+
+    assert count_tokens("one two three four five six seven eight") == 10
+    asyncio.run(asyncio.wait_for(load_token_encoding_in_background(retry_interval=0.01), timeout=2))
+
+    assert len(attempts) == 3
+    assert count_tokens("one two three four five six seven eight") == 8
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from agents.history_manager import SUMMARY_ID, SUMMARY_PREFIX
+
+SESSION = "long-thread"
+CONFIG = {"configurable": {"thread_id": SESSION}}
+
+
+@pytest.fixture(autouse=True)
+def short_history(monkeypatch):
+    monkeypatch.setenv("HISTORY_MAX_TURNS", "3")
+    monkeypatch.setenv("HISTORY_KEEP_TURNS", "2")
+
+
+async def chat(agent, turns):
+    await agent.initialize()
+    for turn in range(turns):
+        await agent.process_message(f"hello number {turn}", SESSION, "token-1")
+    await agent._wait_for_history_fold(SESSION)
+    return (await agent.graph.aget_state(CONFIG)).values["messages"]
+
+
+def user_turns(messages):
+    return [msg.content for msg in messages if isinstance(msg, HumanMessage)]
+
+
+def test_long_thread_folds_into_the_summary(orchestrator):
+    messages = asyncio.run(chat(orchestrator, 4))
+
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].id == SUMMARY_ID
+    assert messages[0].content.startswith(SUMMARY_PREFIX)
+    assert user_turns(messages) == ["hello number 2", "hello number 3"]
+
+
+def test_turn_checkpointed_during_the_fold_is_kept(orchestrator):
+    summarize = orchestrator.history_manager.process
+
+    async def summarize_while_another_worker_answers(state):
+        update = await summarize(state)
+        await orchestrator.graph.ainvoke(orchestrator._initial_state("hello from another worker", SESSION, "token-1"),
+                                         config=CONFIG)
+        return update
+
+    orchestrator.history_manager.process = summarize_while_another_worker_answers
+    messages = asyncio.run(chat(orchestrator, 4))
+
+    assert messages[0].id == SUMMARY_ID
+    assert user_turns(messages) == ["hello number 2", "hello number 3", "hello from another worker"]
+    assert messages[-1].content
+
+
+def test_history_folded_elsewhere_is_left_alone(orchestrator):
+    summarize = orchestrator.history_manager.process
+
+    async def summarize_after_another_worker_folded(state):
+        update = await summarize(state)
+        await orchestrator.graph.aupdate_state(CONFIG, await summarize(state), as_node="end_turn")
+        return update
+
+    orchestrator.history_manager.process = summarize_after_another_worker_folded
+    messages = asyncio.run(chat(orchestrator, 4))
+
+    assert [msg.id for msg in messages].count(SUMMARY_ID) == 1
+    assert user_turns(messages) == ["hello number 2", "hello number 3"]
@@ -0,0 +1,122 @@
+import asyncio
+
+import httpx
+import pytest
+
+from agents import api_agent_with_tools
+from benchmarks.fakes import stub_api_transport
+from util.http_client import ExternalApiClient, init_http_client, close_http_client
+
+
+def scripted_transport(outcomes, calls):
+    """Answers each request with the next outcome, a status code or an exception to raise"""
+    outcomes = list(outcomes)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        outcome = outcomes.pop(0) if len(outcomes) > 1 else outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome, json={"status": outcome})
+
+    return httpx.MockTransport(handler)
+
+
+def send(method, path, outcomes, calls=None, **kwargs):
+    calls = [] if calls is None else calls
+
+    async def run():
+        client = ExternalApiClient(base_url="http://backend", transport=scripted_transport(outcomes, calls))
+        try:
+            return await client.request(method, path, **kwargs)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), calls
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("EXTERNAL_API_MAX_RETRIES", "2")
+    monkeypatch.setenv("EXTERNAL_API_RETRY_BACKOFF", "0")
+
+
+@pytest.mark.parametrize("status", [429, 502, 503, 504])
+def test_get_is_retried_on_retryable_status(status):
+    response, calls = send("GET", "/api/policy/user", [status, 200])
+
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_get_is_retried_on_connect_error():
+    response, calls = send("GET", "/api/policy/user", [httpx.ConnectError("refused"), 200])
+
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_get_gives_up_after_max_retries():
+    response, calls = send("GET", "/api/policy/user", [503])
+
+    assert response.status_code == 503
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("status", [400, 404, 500])
+def test_get_is_not_retried_on_other_status(status):
+    response, calls = send("GET", "/api/policy/user", [status, 200])
+
+    assert response.status_code == status
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status", [429, 502, 503, 504])
+def test_create_claim_is_never_retried(status):
+    response, calls = send("POST", "/api/claim/create-claim", [status, 201], json={"policyNumber": 1234567})
+
+    assert response.status_code == status
+    assert calls == [("POST", "/api/claim/create-claim")]
+
+
+def test_create_claim_is_not_retried_on_connect_error():
+    calls = []
+    with pytest.raises(httpx.ConnectError):
+        send("POST", "/api/claim/create-claim", [httpx.ConnectError("refused"), 201], calls=calls)
+
+    assert len(calls) == 1
+
+
+def submit_claim(transport, token="token-1"):
+    async def run():
+        await init_http_client("http://backend", transport=transport)
+        try:
+            return await api_agent_with_tools.submit_new_claim.ainvoke({
+                "policy_id": "1234567", "damage_description": "dented door", "vehicle": "Toyota Corolla",
+                "token": token,
+            })
+        finally:
+            await close_http_client()
+
+    return asyncio.run(run())
+
+
+def test_submit_claim_against_stub_backend_invalidates_lookups():
+    cache = api_agent_with_tools.lookup_cache
+    cache.put("get_user_policy_details", "token-1", [{"policyNumber": 1234567}], 0.1)
+
+    result = submit_claim(stub_api_transport(latency=0))
+
+    assert result["status"] == "SUBMITTED"
+    assert cache.get("get_user_policy_details", "token-1") is None
+
+
+def test_submit_claim_with_non_json_success_still_invalidates_lookups():
+    cache = api_agent_with_tools.lookup_cache
+    cache.put("get_user_policy_details", "token-1", [{"policyNumber": 1234567}], 0.1)
+    transport = httpx.MockTransport(lambda request: httpx.Response(201, text="Created"))
+
+    result = submit_claim(transport)
+
+    assert "error" not in result
+    assert cache.get("get_user_policy_details", "token-1") is None
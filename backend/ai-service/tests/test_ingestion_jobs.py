@@ -0,0 +1,113 @@
+import asyncio
+
+from benchmarks.fakes import make_pdf
+from util.ingestion_jobs import IngestionJobManager
+from util.local_vector_index import LocalDocumentStore
+
+
+def ingest(uploads):
+    async def run():
+        manager = IngestionJobManager("test_documents", workers=2)
+        await manager.start()
+        jobs = [manager.submit(file_path=path, filename="policy.pdf", **kwargs) for path, kwargs in uploads]
+        await manager.queue.join()
+        await manager.stop()
+        return jobs
+
+    return asyncio.run(run())
+
+
+def indexed_chunks(index_dir, document_key):
+    with LocalDocumentStore("test_documents", index_dir) as store:
+        return store.document_chunks(document_key)
+
+
+def write_pdf(path, seed):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(make_pdf(pages=2, seed=seed))
+    return str(path)
+
+
+def test_different_files_with_the_same_filename_are_both_kept(tmp_path, local_index):
+    first = write_pdf(tmp_path / "a" / "policy.pdf", seed=1)
+    second = write_pdf(tmp_path / "b" / "policy.pdf", seed=2)
+
+    jobs = ingest([(first, {"content_hash": "1"}), (second, {"content_hash": "2"})])
+
+    assert [job.status for job in jobs] == ["completed", "completed"]
+    assert jobs[0].document_key != jobs[1].document_key
+    assert all(indexed_chunks(local_index, job.document_key) for job in jobs)
+
+
+def test_default_key_without_content_hash_is_unique(tmp_path, local_index):
+    first = write_pdf(tmp_path / "a" / "policy.pdf", seed=1)
+    second = write_pdf(tmp_path / "b" / "policy.pdf", seed=2)
+
+    jobs = ingest([(first, {}), (second, {})])
+
+    assert jobs[0].document_key != jobs[1].document_key
+    assert all(indexed_chunks(local_index, job.document_key) for job in jobs)
+
+
+def test_explicit_document_key_replaces_previous_upload(tmp_path, local_index):
+    first = write_pdf(tmp_path / "a" / "policy.pdf", seed=1)
+    second = write_pdf(tmp_path / "b" / "policy.pdf", seed=2)
+
+    ingest([(first, {"document_key": "motor-policy"})])
+    before = indexed_chunks(local_index, "motor-policy")
+    ingest([(second, {"document_key": "motor-policy"})])
+    after = indexed_chunks(local_index, "motor-policy")
+
+    assert before and after
+    assert not set(before) & set(after)
+
+
+def test_progress_counters_and_document_locks_after_concurrent_jobs(tmp_path, local_index):
+    uploads = [(write_pdf(tmp_path / str(seed) / "policy.pdf", seed=seed), {"document_key": f"doc-{seed % 2}"})
+               for seed in range(6)]
+
+    async def run():
+        manager = IngestionJobManager("test_documents", workers=3)
+        await manager.start()
+        jobs = [manager.submit(file_path=path, filename="policy.pdf", **kwargs) for path, kwargs in uploads]
+        await manager.queue.join()
+        await manager.stop()
+        return manager, jobs
+
+    manager, jobs = asyncio.run(run())
+
+    assert manager._document_locks == {}
+    for job in jobs:
+        assert job.status == "completed"
+        assert job.pages_parsed == 2
+        assert job.rows_written == job.chunks_embedded == job.result["chunks_added"]
+
+
+def test_local_index_rejects_uploads_beyond_its_row_limit(tmp_path, local_index, monkeypatch):
+    monkeypatch.setenv("LOCAL_VECTOR_INDEX_MAX_ROWS", "5")
+    path = write_pdf(tmp_path / "a" / "policy.pdf", seed=1)
+
+    job, = ingest([(path, {"document_key": "motor-policy"})])
+
+    assert job.status == "failed"
+    assert "limited to 5 chunks" in job.error
+    assert not indexed_chunks(local_index, "motor-policy")
+
+
+def test_edited_document_only_reembeds_changed_chunks(tmp_path, local_index):
+    original = write_pdf(tmp_path / "a" / "policy.pdf", seed=1)
+    edited = tmp_path / "b" / "policy.pdf"
+    edited.parent.mkdir()
+    edited.write_bytes(make_pdf(pages=2, seed=1, edited_pages=[1]))
+
+    first, = ingest([(original, {"document_key": "motor-policy"})])
+    before = indexed_chunks(local_index, "motor-policy")
+    second, = ingest([(str(edited), {"document_key": "motor-policy"})])
+    after = indexed_chunks(local_index, "motor-policy")
+
+    assert second.status == "completed"
+    assert 0 < second.chunks_unchanged < first.chunks_embedded
+    assert second.chunks_embedded == second.result["chunks_added"] == len(set(after) - set(before))
+    assert second.chunks_embedded + second.chunks_unchanged == len(after)
+    assert second.result["chunks_deleted"] == len(set(before) - set(after)) > 0
+    assert set(after.values()) == {second.result["document_hash"]}
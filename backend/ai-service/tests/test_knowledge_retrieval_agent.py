@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from langchain_core.messages import HumanMessage
+
+from agents.knowledge_retrieval_agent import KnowledgeRetrievalAgent
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from conftest import use_embeddings
+
+
+class SlowEmbeddings(FakeEmbeddings):
+    async def aembed_query(self, text):
+        await asyncio.sleep(5)
+        return self.embed_query(text)
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    async def aembed_query(self, text):
+        raise RuntimeError("embeddings unavailable")
+
+
+def make_agent(monkeypatch):
+    monkeypatch.setenv("RETRIEVAL_TIMEOUT", "0.2")
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "true")
+    agent = KnowledgeRetrievalAgent(None)
+    agent.llm = FakeChatModel(latency=0, completion_tokens=5)
+    return agent
+
+
+def ask(agent, question, session_id="s1"):
+    state = {"messages": [HumanMessage(question)], "session_id": session_id, "context": {},
+             "current_step": "start", "error": None}
+    return asyncio.run(agent.process(state))
+
+
+def test_slow_query_embedding_is_bounded_by_the_retrieval_timeout(local_index, monkeypatch):
+    use_embeddings(monkeypatch, SlowEmbeddings())
+    agent = make_agent(monkeypatch)
+
+    started = time.perf_counter()
+    state = ask(agent, "what does comprehensive cover include")
+
+    assert time.perf_counter() - started < 2
+    assert state["error"] is None
+    assert state["current_step"] == "knowledge_retrieved"
+    assert state["messages"][-1].type == "ai"
+
+
+def test_failing_query_embedding_degrades_to_no_documents(local_index, monkeypatch):
+    use_embeddings(monkeypatch, FailingEmbeddings())
+    agent = make_agent(monkeypatch)
+
+    state = ask(agent, "what does comprehensive cover include")
+
+    assert state["error"] is None
+    assert state["context"]["retrieved_documents"] == []
+    assert state["messages"][-1].type == "ai"
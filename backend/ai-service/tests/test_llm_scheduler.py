@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fakes import FakeChatModel, ScheduledFakeChatModel
+from util import llm_scheduler
+from util.llm_scheduler import LlmOverloaded, LlmScheduler, ScheduledChatModel, TokenBucket
+
+
+def rate_limit_error(retry_after: float) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": str(retry_after)}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class RateLimitedChatModel(FakeChatModel):
+    """Answers 429 with Retry-After for the first rate_limited calls, recording when each call reached it"""
+    rate_limited: int = 1
+    retry_after: float = 0.3
+    calls: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.rate_limited:
+            raise rate_limit_error(self.retry_after)
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+class ScheduledRateLimitedChatModel(ScheduledChatModel, RateLimitedChatModel):
+    pass
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    def install(**kwargs):
+        kwargs.setdefault("max_retries", 2)
+        monkeypatch.setattr(llm_scheduler, "_scheduler", LlmScheduler(**kwargs))
+        return llm_scheduler._scheduler
+
+    return install
+
+
+def test_token_bucket_waits_for_refill():
+    async def scenario():
+        bucket = TokenBucket(tokens_per_minute=600)
+        started = time.monotonic()
+        await bucket.acquire(600)
+        full_bucket = time.monotonic() - started
+        await bucket.acquire(3)
+        return full_bucket, time.monotonic() - started
+
+    full_bucket, elapsed = asyncio.run(scenario())
+    assert full_bucket < 0.05
+    # 10 tokens a second
+    assert 0.25 <= elapsed < 0.6
+
+
+def test_model_concurrency_limits_each_model_separately(scheduler):
+    limiter = scheduler(max_concurrency=10, model_concurrency={"small": 2})
+    in_flight = {"small": 0, "large": 0}
+    peak = {"small": 0, "large": 0}
+
+    async def call(model):
+        async with limiter.slot(model, tokens=10):
+            in_flight[model] += 1
+            peak[model] = max(peak[model], in_flight[model])
+            await asyncio.sleep(0.05)
+            in_flight[model] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(call(model) for model in ["small", "large"] * 6))
+
+    asyncio.run(scenario())
+    assert peak == {"small": 2, "large": 6}
+
+
+def test_rate_limit_pauses_the_model_until_retry_after(scheduler):
+    scheduler(max_concurrency=4)
+    model = ScheduledRateLimitedChatModel(latency=0, completion_tokens=1, model_name="limited", calls=[])
+
+    async def scenario():
+        first = asyncio.ensure_future(model.ainvoke([HumanMessage("first")]))
+        await asyncio.sleep(0.05)
+        # arrives while the model is paused, waits instead of hitting the 429 itself
+        second = await model.ainvoke([HumanMessage("second")])
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.content and second.content
+    assert len(model.calls) == 3
+    assert all(call - model.calls[0] >= 0.29 for call in model.calls[1:])
+
+
+def test_rate_limit_retries_give_up_after_max_retries(scheduler):
+    scheduler(max_retries=1)
+    model = ScheduledRateLimitedChatModel(latency=0, completion_tokens=1, rate_limited=5, retry_after=0.01,
+                                          model_name="limited", calls=[])
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(model.ainvoke([HumanMessage("hello")]))
+    assert len(model.calls) == 2
+
+
+def test_queue_timeout_sheds_with_llm_overloaded(scheduler):
+    limiter = scheduler(max_concurrency=1, queue_timeout=0.1)
+
+    async def scenario():
+        async with limiter.slot("model", tokens=10):
+            started = time.monotonic()
+            with pytest.raises(LlmOverloaded) as overloaded:
+                async with limiter.slot("model", tokens=10):
+                    pass
+            return overloaded.value, time.monotonic() - started
+
+    error, waited = asyncio.run(scenario())
+    assert error.retry_after == 0.1
+    assert 0.09 <= waited < 0.5
+    assert limiter.waiting == 0
+
+
+def test_full_queue_sheds_immediately(scheduler):
+    limiter = scheduler(max_concurrency=1, max_queue=1, queue_timeout=5)
+
+    async def hold(release: asyncio.Event):
+        async with limiter.slot("model", tokens=10):
+            await release.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(release))
+        queued = asyncio.ensure_future(hold(release))
+        await asyncio.sleep(0.01)
+        assert limiter.overloaded()
+        started = time.monotonic()
+        with pytest.raises(LlmOverloaded):
+            async with limiter.slot("model", tokens=10):
+                pass
+        shed_after = time.monotonic() - started
+        release.set()
+        await asyncio.gather(holder, queued)
+        return shed_after
+
+    assert asyncio.run(scenario()) < 0.05
+    assert not llm_scheduler._scheduler.overloaded()
+
+
+def test_benchmark_fake_goes_through_the_scheduler(scheduler):
+    limiter = scheduler(max_concurrency=1, queue_timeout=0.05)
+    model = ScheduledFakeChatModel(latency=0.2, completion_tokens=1)
+
+    async def scenario():
+        first = asyncio.ensure_future(model.ainvoke([HumanMessage("first")]))
+        await asyncio.sleep(0.01)
+        try:
+            await model.ainvoke([HumanMessage("second")])
+        finally:
+            await first
+
+    with pytest.raises(LlmOverloaded):
+        asyncio.run(scenario())
+    assert isinstance(model.bind_tools([]), ScheduledFakeChatModel)
+    assert limiter.waiting == 0
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+from agents.knowledge_retrieval_agent import KnowledgeRetrievalAgent
+from agents.local_router import LocalRouter
+
+
+@pytest.fixture
+def knowledge_hint(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "false")
+    return KnowledgeRetrievalAgent(None).is_knowledge_query
+
+
+def make_router(knowledge_hint, threshold=0.85, min_samples=200, log_path=""):
+    return LocalRouter(knowledge_hint=knowledge_hint, log_path=log_path, threshold=threshold, min_samples=min_samples)
+
+
+@pytest.mark.parametrize("message, agent", [
+    ("hello", "fallback"),
+    ("Thanks!", "fallback"),
+    ("what is the status of claim 1234567", "api"),
+    ("1234567", "api"),
+    ("can you check my claim status", "api"),
+    ("I want to submit a claim for my car", "api"),
+    ("show my policy", "api"),
+])
+def test_obvious_intents_are_routed_by_rules(knowledge_hint, message, agent):
+    decision = make_router(knowledge_hint).route(message)
+
+    assert decision.agent == agent
+    assert decision.confidence >= 0.85
+
+
+@pytest.mark.parametrize("message", [
+    "what is my deductible?",
+    "how much is my premium",
+    "what does my coverage include",
+    "what is a deductible",
+    "my car was hit in the parking lot",
+])
+def test_ambiguous_questions_are_left_to_the_llm(knowledge_hint, message):
+    assert make_router(knowledge_hint).route(message) is None
+
+
+def test_rules_below_the_threshold_are_left_to_the_llm(knowledge_hint):
+    router = make_router(knowledge_hint, threshold=0.96)
+
+    assert router.route("hello").agent == "fallback"
+    assert router.route("what is the status of claim 1234567") is None
+    # a rule that matched does not fall through to the knowledge keywords
+    assert router.route("explain what my policy covers") is None
+
+
+def test_knowledge_keywords_route_locally_with_a_lower_threshold(knowledge_hint):
+    decision = make_router(knowledge_hint, threshold=0.8).route("what is a deductible")
+
+    assert decision.agent == "knowledge"
+
+
+def test_classifier_learns_from_llm_decisions(knowledge_hint, tmp_path):
+    log_path = str(tmp_path / "routes.jsonl")
+    router = make_router(knowledge_hint, min_samples=20, log_path=log_path)
+    examples = [("my windscreen cracked, can I get it repaired", "api"),
+                ("how do excess payments work for windscreens", "knowledge")]
+
+    async def train():
+        for _ in range(10):
+            for message, agent in examples:
+                await router.record(message, agent)
+
+    assert router.route("my windscreen cracked again") is None
+    asyncio.run(train())
+
+    assert router.route("my windscreen cracked again").agent == "api"
+    # the scrubbed log trains a new worker the same way
+    reloaded = make_router(knowledge_hint, min_samples=20, log_path=log_path)
+    assert reloaded.classifier.samples == 20
+    assert reloaded.route("my windscreen cracked again").agent == "api"
+    with open(log_path, encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"message": examples[0][0], "agent": "api"}
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from langchain_core.tools import tool
+
+from util.tool_executor import ToolExecutor
+
+events = []
+
+
+def record(name, started):
+    events.append((name, started, time.monotonic()))
+
+
+@tool
+async def get_claim_details(claim_id: str, token: str) -> dict:
+    """Slow read-only lookup"""
+    started = time.monotonic()
+    await asyncio.sleep(0.2)
+    record(f"claim {claim_id}", started)
+    return {"claim_id": claim_id, "token": token}
+
+
+@tool
+async def get_user_policy_details(token: str, delay: float = 0.2) -> dict:
+    """Read-only lookup, sleeping for delay"""
+    started = time.monotonic()
+    await asyncio.sleep(delay)
+    record("policy", started)
+    return {"policies": [], "token": token}
+
+
+@tool
+async def submit_new_claim(policy_id: str, token: str) -> dict:
+    """Side-effecting call slower than the read-only timeout"""
+    started = time.monotonic()
+    await asyncio.sleep(0.4)
+    record(f"submit {policy_id}", started)
+    return {"status": 201, "policy_id": policy_id}
+
+
+def run(tool_calls, timeout=1.0):
+    events.clear()
+    executor = ToolExecutor([get_claim_details, get_user_policy_details, submit_new_claim],
+                            side_effecting={"submit_new_claim"}, timeout=timeout)
+    finished = []
+    started = time.monotonic()
+    results = asyncio.run(executor.run(tool_calls, lambda call, result: finished.append(call["id"]), token="token-1"))
+    return results, finished, time.monotonic() - started
+
+
+def call(name, call_id, **args):
+    return {"name": name, "args": args, "id": call_id}
+
+
+def test_read_only_calls_overlap():
+    results, finished, elapsed = run([call("get_claim_details", "a", claim_id="1"),
+                                      call("get_user_policy_details", "b")])
+
+    assert results["a"] == {"claim_id": "1", "token": "token-1"}
+    assert results["b"]["token"] == "token-1"
+    assert sorted(finished) == ["a", "b"]
+    assert elapsed < 0.35
+
+
+def test_side_effecting_calls_run_serially_in_order():
+    results, finished, elapsed = run([call("submit_new_claim", "first", policy_id="P1"),
+                                      call("get_claim_details", "lookup", claim_id="1"),
+                                      call("submit_new_claim", "second", policy_id="P2")])
+
+    timings = {name: (start, end) for name, start, end in events}
+    assert timings["submit P2"][0] >= timings["submit P1"][1]
+    # the lookup does not wait for the writes
+    assert timings["claim 1"][0] < timings["submit P1"][1]
+    assert finished == ["lookup", "first", "second"]
+    assert results["second"]["status"] == 201
+    assert elapsed >= 0.8
+
+
+def test_only_read_only_calls_time_out():
+    results, finished, elapsed = run([call("get_user_policy_details", "slow", delay=1.0),
+                                      call("submit_new_claim", "write", policy_id="P1")], timeout=0.1)
+
+    assert "did not respond within 0.1 seconds" in results["slow"]["error"]
+    assert results["write"] == {"status": 201, "policy_id": "P1"}
+    assert [name for name, _, _ in events] == ["submit P1"]
+    assert finished == ["slow", "write"]
+    assert 0.35 <= elapsed < 0.9
+
+
+def test_unknown_tool_returns_an_error():
+    results, _, _ = run([call("delete_everything", None)])
+
+    assert results == {"delete_everything-0": {"error": "Unknown tool delete_everything"}}
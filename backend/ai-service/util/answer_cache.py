@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from util.metrics import ANSWER_CACHE_ENTRIES, ANSWER_CACHE_INVALIDATIONS, ANSWER_CACHE_LOOKUPS, \
+    ANSWER_CACHE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    vector: np.ndarray
+    answer: str
+    retrieved_documents: List[Dict[str, Any]]
+    # how long the original retrieval + generation took, credited as saved time on every hit
+    cost_seconds: float
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """Reuses answers for queries whose embedding is close enough to an already answered query.
+
+    Entries expire after ttl_seconds, the least recently used entry is evicted once max_entries
+    is reached and the whole cache is flushed when its collection is re-ingested. The cache is per
+    process: the local vector index flushes it in every process that loads the new snapshot, with
+    pgvector only the process that ran the ingestion is flushed and the others serve their cached
+    answers until they expire.
+    """
+
+    def __init__(self, collection_name: str, threshold: Optional[float] = None,
+                 ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.collection_name = collection_name
+        self.threshold = threshold or float(getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.ttl_seconds = ttl_seconds or float(getenv("ANSWER_CACHE_TTL", "3600"))
+        self.max_entries = max_entries or int(getenv("ANSWER_CACHE_SIZE", "1000"))
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, query_vector: List[float]) -> Optional[CachedAnswer]:
+        vector = self._normalize(query_vector)
+        with self._lock:
+            self._expire(time.time())
+            if not self._entries:
+                ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+                ANSWER_CACHE_ENTRIES.set(0)
+                return None
+
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[key].vector for key in self._matrix_ids])
+
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+                return None
+
+            entry_id = self._matrix_ids[best]
+            self._entries.move_to_end(entry_id)
+            entry = self._entries[entry_id]
+
+        ANSWER_CACHE_LOOKUPS.labels(result="hit").inc()
+        ANSWER_CACHE_SAVED_SECONDS.inc(entry.cost_seconds)
+        logger.info(f"Answer cache hit (similarity {scores[best]:.3f}) for query similar to: {entry.query}")
+        return entry
+
+    def store(self, query: str, query_vector: List[float], answer: str,
+              retrieved_documents: List[Dict[str, Any]], cost_seconds: float):
+        with self._lock:
+            self._entries[self._next_id] = CachedAnswer(
+                query=query,
+                vector=self._normalize(query_vector),
+                answer=answer,
+                retrieved_documents=retrieved_documents,
+                cost_seconds=cost_seconds,
+                created_at=time.time(),
+            )
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            ANSWER_CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            ANSWER_CACHE_ENTRIES.set(0)
+
+
+_caches: List[SemanticAnswerCache] = []
+
+
+def invalidate_answer_caches(collection_name: str):
+    """Flush cached answers built from a collection that has just changed"""
+    for cache in _caches:
+        if cache.collection_name == collection_name:
+            cache.clear()
+            ANSWER_CACHE_INVALIDATIONS.inc()
+            logger.info(f"Answer cache for {collection_name} invalidated")
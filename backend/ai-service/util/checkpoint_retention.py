@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import logging
+from os import getenv
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from util.metrics import CHECKPOINT_RETENTION_DELETED
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes")
+
+# threads idle for longer than the ttl, a batch of them at a time. The deletes only see rows committed
+# before the statement started, so a checkpoint written to the thread meanwhile survives. Its blobs are
+# therefore left to PRUNE_BLOBS_SQL, which only drops unreferenced blobs of threads idle for the grace period
+EXPIRE_THREADS_SQL = """
+WITH idle AS (
+    SELECT thread_id FROM checkpoints
+    GROUP BY thread_id
+    HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - make_interval(secs => %(ttl)s)
+    LIMIT %(batch)s
+), deleted_writes AS (
+    DELETE FROM checkpoint_writes WHERE thread_id IN (SELECT thread_id FROM idle) RETURNING 1
+), deleted AS (
+    DELETE FROM checkpoints WHERE thread_id IN (SELECT thread_id FROM idle) RETURNING 1
+)
+SELECT (SELECT count(*) FROM idle) AS threads, (SELECT count(*) FROM deleted) AS checkpoints,
+       (SELECT count(*) FROM deleted_writes) AS checkpoint_writes
+"""
+
+# checkpoints older than the latest keep_latest of their thread, together with their pending writes.
+# Only a batch of threads with more than keep_latest checkpoints is ranked, not the whole table
+PRUNE_CHECKPOINTS_SQL = """
+WITH crowded AS (
+    SELECT thread_id, checkpoint_ns FROM checkpoints
+    GROUP BY thread_id, checkpoint_ns
+    HAVING count(*) > %(keep)s
+    LIMIT %(batch)s
+), ranked AS (
+    SELECT c.thread_id, c.checkpoint_ns, c.checkpoint_id,
+           row_number() OVER (PARTITION BY c.thread_id, c.checkpoint_ns ORDER BY c.checkpoint_id DESC) AS rn
+    FROM checkpoints c JOIN crowded USING (thread_id, checkpoint_ns)
+), doomed AS (
+    SELECT thread_id, checkpoint_ns, checkpoint_id FROM ranked WHERE rn > %(keep)s LIMIT %(batch)s
+), deleted AS (
+    DELETE FROM checkpoints c USING doomed d
+    WHERE c.thread_id = d.thread_id AND c.checkpoint_ns = d.checkpoint_ns AND c.checkpoint_id = d.checkpoint_id
+    RETURNING c.thread_id, c.checkpoint_ns, c.checkpoint_id
+), deleted_writes AS (
+    DELETE FROM checkpoint_writes w USING deleted d
+    WHERE w.thread_id = d.thread_id AND w.checkpoint_ns = d.checkpoint_ns AND w.checkpoint_id = d.checkpoint_id
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM deleted) AS checkpoints, (SELECT count(*) FROM deleted_writes) AS writes
+"""
+
+# channel values no remaining checkpoint points at. Blobs are written before their checkpoint row,
+# so threads that were active within the grace period are left alone
+PRUNE_BLOBS_SQL = """
+WITH doomed AS (
+    SELECT b.thread_id, b.checkpoint_ns, b.channel, b.version
+    FROM checkpoint_blobs b
+    WHERE NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+          AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+    ) AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id
+          AND (c.checkpoint ->> 'ts')::timestamptz >= now() - make_interval(secs => %(grace)s)
+    )
+    LIMIT %(batch)s
+)
+DELETE FROM checkpoint_blobs b USING doomed d
+WHERE b.thread_id = d.thread_id AND b.checkpoint_ns = d.checkpoint_ns
+  AND b.channel = d.channel AND b.version = d.version
+"""
+
+TABLE_SIZES_SQL = """
+SELECT relname AS table_name, n_live_tup AS rows, pg_total_relation_size(relid) AS bytes
+FROM pg_stat_user_tables WHERE relname = ANY(%(tables)s)
+"""
+
+
+class CheckpointRetention:
+    """Prunes the LangGraph checkpoint tables in bounded batches.
+
+    Keeps the latest keep_latest checkpoints of every thread, deletes threads that have been idle
+    for longer than idle_ttl seconds (0, the default, keeps them) and removes channel blobs that are no longer
+    referenced, including those of expired threads. Each batch is its own short transaction so it never holds locks for long.
+    """
+
+    def __init__(self, pool: AsyncConnectionPool, keep_latest: Optional[int] = None,
+                 idle_ttl: Optional[float] = None, batch_size: Optional[int] = None,
+                 interval: Optional[float] = None, max_batches: Optional[int] = None):
+        self.pool = pool
+        self.keep_latest = max(1, keep_latest or int(getenv("CHECKPOINT_KEEP_LATEST", "20")))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(getenv("CHECKPOINT_IDLE_TTL", "0"))
+        self.batch_size = batch_size or int(getenv("CHECKPOINT_RETENTION_BATCH", "500"))
+        self.interval = interval or float(getenv("CHECKPOINT_RETENTION_INTERVAL", "600"))
+        # upper bound on the work done per run, the rest is picked up by the next run
+        self.max_batches = max_batches or int(getenv("CHECKPOINT_RETENTION_MAX_BATCHES", "20"))
+        self.blob_grace = float(getenv("CHECKPOINT_RETENTION_GRACE", "300"))
+        self._task: Optional[asyncio.Task] = None
+
+    async def _expire_threads(self) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(EXPIRE_THREADS_SQL, {"ttl": self.idle_ttl, "batch": self.batch_size})
+            row = await cur.fetchone()
+        for table in ("threads", "checkpoints", "checkpoint_writes"):
+            CHECKPOINT_RETENTION_DELETED.labels(table=table).inc(row[table])
+        return row["threads"]
+
+    async def _prune_checkpoints(self) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(PRUNE_CHECKPOINTS_SQL, {"keep": self.keep_latest, "batch": self.batch_size})
+            row = await cur.fetchone()
+        CHECKPOINT_RETENTION_DELETED.labels(table="checkpoints").inc(row["checkpoints"])
+        CHECKPOINT_RETENTION_DELETED.labels(table="checkpoint_writes").inc(row["writes"])
+        return row["checkpoints"]
+
+    async def _prune_blobs(self) -> int:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(PRUNE_BLOBS_SQL, {"grace": self.blob_grace, "batch": self.batch_size})
+        CHECKPOINT_RETENTION_DELETED.labels(table="checkpoint_blobs").inc(cur.rowcount)
+        return cur.rowcount
+
+    async def run_once(self) -> Dict[str, int]:
+        """One retention pass, each step stops after max_batches batches and resumes on the next pass"""
+        steps = {"threads": self._expire_threads, "checkpoints": self._prune_checkpoints,
+                 "checkpoint_blobs": self._prune_blobs}
+        if self.idle_ttl <= 0:
+            del steps["threads"]
+        totals = {}
+        for name, step in steps.items():
+            totals[name] = 0
+            for _ in range(self.max_batches):
+                deleted = await step()
+                totals[name] += deleted
+                if deleted < self.batch_size:
+                    break
+                # let request traffic in between batches
+                await asyncio.sleep(0)
+        logger.info(f"Checkpoint retention deleted {totals}")
+        return totals
+
+    async def table_sizes(self) -> Dict[str, Dict[str, int]]:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(TABLE_SIZES_SQL, {"tables": list(CHECKPOINT_TABLES)})
+            rows = await cur.fetchall()
+        return {row["table_name"]: {"rows": row["rows"], "bytes": row["bytes"]} for row in rows}
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Checkpoint retention run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _format_sizes(sizes: Dict[str, Dict[str, int]]) -> str:
+    return "\n".join(
+        f"  {table:<20} {size.get('rows', 0):>12} rows {size.get('bytes', 0) / 1024 / 1024:>10.1f} MB"
+        for table, size in ((table, sizes.get(table, {})) for table in CHECKPOINT_TABLES)
+    )
+
+
+async def _main(args):
+    pool = AsyncConnectionPool(args.database_url, min_size=1, max_size=2, open=False,
+                               kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row})
+    await pool.open(wait=True)
+    try:
+        retention = CheckpointRetention(pool, keep_latest=args.keep_latest, idle_ttl=args.idle_ttl,
+                                        batch_size=args.batch_size, max_batches=args.max_batches)
+        before = await retention.table_sizes()
+        print(f"Checkpoint tables before:\n{_format_sizes(before)}")
+        if args.report:
+            return
+        totals = await retention.run_once()
+        async with pool.connection() as conn:
+            # refresh the statistics the size report is read from
+            for table in CHECKPOINT_TABLES:
+                await conn.execute(f"VACUUM ANALYZE {table}")
+        print(f"Deleted: {totals}")
+        print(f"Checkpoint tables after:\n{_format_sizes(await retention.table_sizes())}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Prune LangGraph checkpoint tables and report their size")
+    parser.add_argument("--database-url", default=getenv("DB_URL"))
+    parser.add_argument("--report", action="store_true", help="only report table sizes")
+    parser.add_argument("--keep-latest", type=int, default=None)
+    parser.add_argument("--idle-ttl", type=float, default=None, help="seconds, 0 keeps idle threads")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--max-batches", type=int, default=None)
+    asyncio.run(_main(parser.parse_args()))
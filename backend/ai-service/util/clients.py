@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from os import getenv
+from typing import Dict, Optional, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from util.embedding_cache import CachedEmbeddings, get_cached_embeddings
+from util.instrumentation import LlmMetricsCallback
+from util.llm_scheduler import ScheduledChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_chat_models: Dict[Tuple[Optional[str], float], ChatOpenAI] = {}
+_vector_stores: Dict[str, object] = {}
+_engine = None
+_ingestion_engines: Dict[str, object] = {}
+
+
+def get_chat_model(agent: str, model: Optional[str] = None, temperature: float = 0.8) -> ChatOpenAI:
+    """Chat model for an agent, agents asking for the same model config share one OpenAI client.
+
+    The returned model is a shallow copy carrying the agent's metrics callback, its HTTP client and
+    connection pool are the shared ones.
+    """
+    key = (model or getenv("MODEL_NAME"), temperature)
+    with _lock:
+        if key not in _chat_models:
+            started = time.perf_counter()
+            _chat_models[key] = ScheduledChatOpenAI(
+                # api_key=getenv("OPENROUTER_API_KEY"),
+                # base_url=getenv("OPENROUTER_BASE_URL"),
+                model=key[0],
+                temperature=temperature,
+                # token usage is reported for streamed calls as well
+                stream_usage=True,
+                # retries are left to the LLM scheduler, which coordinates backoff across all calls
+                max_retries=0,
+            )
+            logger.info(f"Created chat model client {key[0]} (temperature {temperature}) "
+                        f"in {time.perf_counter() - started:.3f}s")
+        shared = _chat_models[key]
+    return shared.model_copy(update={"callbacks": [LlmMetricsCallback(agent)]})
+
+
+def get_embeddings() -> CachedEmbeddings:
+    return get_cached_embeddings()
+
+
+def get_vector_store(collection_name: str = "policy_documents"):
+    """Retrieval side vector store of the configured VECTOR_STORE_BACKEND, built on first use"""
+    global _engine
+    with _lock:
+        if collection_name in _vector_stores:
+            return _vector_stores[collection_name]
+        started = time.perf_counter()
+        if getenv("VECTOR_STORE_BACKEND", "pgvector") == "local":
+            from util.local_vector_index import LocalVectorIndex
+            # in-process index built by ingestion, no database round trip per query
+            store = LocalVectorIndex(
+                collection_name=collection_name,
+                index_dir=getenv("LOCAL_VECTOR_INDEX_DIR", ".cache/vector_index"),
+                reload_interval=float(getenv("LOCAL_VECTOR_INDEX_RELOAD_INTERVAL", "1")),
+                nprobe=int(getenv("LOCAL_VECTOR_INDEX_NPROBE", "8")),
+            )
+        else:
+            # imported here, langchain_postgres alone adds more than half a second to startup
+            from langchain_postgres import PGVector
+            from sqlalchemy.ext.asyncio import create_async_engine
+            if _engine is None:
+                # native async engine, its connection pool (not the thread pool) bounds concurrent searches
+                _engine = create_async_engine(
+                    getenv("KNOWLEDGE_DB_URL"),
+                    pool_size=int(getenv("KNOWLEDGE_POOL_SIZE", "10")),
+                    max_overflow=int(getenv("KNOWLEDGE_POOL_MAX_OVERFLOW", "10")),
+                    pool_timeout=float(getenv("KNOWLEDGE_POOL_TIMEOUT", "5")),
+                    pool_recycle=int(getenv("KNOWLEDGE_POOL_RECYCLE", "1800")),
+                    pool_pre_ping=True,
+                )
+            store = PGVector(
+                embeddings=get_embeddings(),
+                collection_name=collection_name,
+                connection=_engine,
+                use_jsonb=True,
+                async_mode=True,
+            )
+        _vector_stores[collection_name] = store
+        logger.info(f"Created vector store for {collection_name} in {time.perf_counter() - started:.3f}s")
+        return store
+
+
+def get_ingestion_engine(url: str):
+    """Synchronous engine for ingestion jobs, which run in worker threads, shared by all jobs on the same database"""
+    with _lock:
+        if url not in _ingestion_engines:
+            from sqlalchemy import create_engine
+            _ingestion_engines[url] = create_engine(
+                url,
+                pool_size=int(getenv("INGEST_WORKERS", "2")),
+                max_overflow=int(getenv("INGEST_EMBED_CONCURRENCY", "4")),
+                pool_recycle=int(getenv("KNOWLEDGE_POOL_RECYCLE", "1800")),
+                pool_pre_ping=True,
+            )
+        return _ingestion_engines[url]
+
+
+def warm_up():
+    """Build the default clients ahead of the first request, run off the event loop after startup"""
+    started = time.perf_counter()
+    try:
+        get_chat_model("warmup")
+        get_embeddings()
+        get_vector_store()
+        logger.info(f"Client warm-up finished in {time.perf_counter() - started:.3f}s")
+    except Exception as e:
+        logger.error(f"Error warming up clients: {e}")
+
+
+async def close_clients():
+    global _engine
+    with _lock:
+        engine, _engine = _engine, None
+        _vector_stores.clear()
+        ingestion_engines = list(_ingestion_engines.values())
+        _ingestion_engines.clear()
+    if engine is not None:
+        await engine.dispose()
+    for ingestion_engine in ingestion_engines:
+        ingestion_engine.dispose()
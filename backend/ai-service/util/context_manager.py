@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import math
+from os import getenv
+from typing import Any, Dict, Optional, Tuple
+
+from util.metrics import PROMPT_CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# written by the router and the knowledge agent, only meaningful for the turn that produced them
+PER_TURN_KEYS = ("routing_decision", "retrieved_documents", "knowledge_retrieved")
+
+# what each prompt gets to see of the context, every other key holds a tool result
+PROMPT_FIELDS = {
+    # the router only needs to know which lookups already happened
+    "routing": {"tool_results": "names", "documents": False},
+    "api": {"tool_results": "full", "documents": False},
+    "fallback": {"tool_results": "full", "documents": True},
+}
+DEFAULT_BUDGETS = {"routing": 300, "api": 1500, "fallback": 3000}
+
+# below this a truncated field is not worth keeping
+MIN_FIELD_TOKENS = 16
+TRUNCATED_MARKER = " ...[truncated]"
+
+
+# set once tiktoken has loaded, until then token counts are estimated from the text length
+_token_encoding = None
+
+
+def _encoding():
+    return _token_encoding
+
+
+def load_token_encoding() -> bool:
+    """Load the tokenizer, it may download its BPE file, so call it off the event loop"""
+    global _token_encoding
+    if _token_encoding is None:
+        try:
+            import tiktoken
+            try:
+                _token_encoding = tiktoken.encoding_for_model(getenv("MODEL_NAME") or "gpt-4o")
+            except KeyError:
+                _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken encoding unavailable, estimating token counts from length: {e}")
+    return _token_encoding is not None
+
+
+async def load_token_encoding_in_background(retry_interval: Optional[float] = None):
+    """Load the tokenizer off the event loop, retrying every TOKEN_ENCODING_RETRY_INTERVAL seconds until it loads"""
+    retry_interval = retry_interval or float(getenv("TOKEN_ENCODING_RETRY_INTERVAL", "60"))
+    while not await asyncio.to_thread(load_token_encoding):
+        await asyncio.sleep(retry_interval)
+    logger.info("tiktoken encoding loaded")
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+class ContextManager:
+    """Renders AgentState.context for a prompt within a per-prompt token budget.
+
+    Each prompt only gets the fields it needs. When those still exceed the budget the largest
+    fields are truncated first and fields that would end up too small are dropped.
+    Budgets are read from CONTEXT_TOKENS_<PROMPT> env variables.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, carry_budget: Optional[int] = None):
+        self.budgets = {
+            prompt: int(getenv(f"CONTEXT_TOKENS_{prompt.upper()}", str(default)))
+            for prompt, default in DEFAULT_BUDGETS.items()
+        }
+        self.budgets.update(budgets or {})
+        # tool results kept in the checkpoint once a turn is over
+        self.carry_budget = carry_budget or int(getenv("CONTEXT_TOKENS_CARRY", "500"))
+
+    @staticmethod
+    def _select(context: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        fields = PROMPT_FIELDS[prompt]
+        tool_results = {key: value for key, value in context.items() if key not in PER_TURN_KEYS}
+        selected: Dict[str, Any] = {}
+        if fields["tool_results"] == "names":
+            if tool_results:
+                selected["completed_lookups"] = list(tool_results)
+        else:
+            selected.update(tool_results)
+        if fields["documents"] and context.get("retrieved_documents"):
+            # chunk metadata is only useful for debugging, never for the answer
+            selected["retrieved_documents"] = [
+                {"title": doc.get("title"), "content": doc.get("content")}
+                for doc in context["retrieved_documents"]
+            ]
+        return selected
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """Cut serialized JSON to a string that still fits max_tokens once it is escaped again"""
+        limit = max_tokens - count_tokens(TRUNCATED_MARKER)
+        while True:
+            truncated = truncate_tokens(text, limit) + TRUNCATED_MARKER
+            size = count_tokens(json.dumps(truncated))
+            if size <= max_tokens or limit <= 1:
+                return truncated
+            limit = max(1, limit * max_tokens // size - 1)
+
+    @staticmethod
+    def _fit(fields: Dict[str, Any], budget: int) -> Tuple[Dict[str, Any], int]:
+        """Shrink the fields until they fit the budget, returns the fields and their token count"""
+        encoded = {key: json.dumps(value, default=str) for key, value in fields.items()}
+        sizes = {key: count_tokens(text) for key, text in encoded.items()}
+        total = sum(sizes.values())
+        if total <= budget:
+            return fields, total
+
+        # fair share: small fields are kept whole, the budget left over is split between the large ones
+        fitted: Dict[str, Any] = {}
+        remaining = budget
+        omitted = []
+        pending = sorted(sizes, key=sizes.get)
+        while pending:
+            share = remaining // len(pending)
+            key = pending.pop(0)
+            if sizes[key] <= share:
+                fitted[key] = fields[key]
+                remaining -= sizes[key]
+            elif share >= MIN_FIELD_TOKENS:
+                fitted[key] = ContextManager._truncate(encoded[key], share)
+                remaining -= share
+            else:
+                omitted.append(key)
+        if omitted:
+            fitted["omitted_fields"] = omitted
+        return fitted, count_tokens(json.dumps(fitted, default=str))
+
+    def render(self, context: Dict[str, Any], prompt: str) -> str:
+        """JSON for the {context} placeholder of the given prompt"""
+        context = context or {}
+        before = count_tokens(json.dumps(context, default=str))
+        fitted, after = self._fit(self._select(context, prompt), self.budgets[prompt])
+        PROMPT_CONTEXT_TOKENS.labels(prompt=prompt, stage="before").observe(before)
+        PROMPT_CONTEXT_TOKENS.labels(prompt=prompt, stage="after").observe(after)
+        logger.info(f"{prompt} prompt context compacted from {before} to {after} tokens")
+        return json.dumps(fitted, default=str)
+
+    def end_turn(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Context to checkpoint once the turn is over: per-turn data dropped, tool results compacted"""
+        tool_results = {key: value for key, value in (context or {}).items() if key not in PER_TURN_KEYS}
+        fitted, _ = self._fit(tool_results, self.carry_budget)
+        return fitted
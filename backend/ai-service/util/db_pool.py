@@ -0,0 +1,33 @@
+import logging
+from os import getenv
+
+from psycopg_pool import AsyncConnectionPool
+
+from util.metrics import register_pool_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def create_async_pool(conninfo: str, name: str, env_prefix: str, **connection_kwargs) -> AsyncConnectionPool:
+    """Build a health-checked async connection pool sized from <env_prefix>_POOL_* env variables.
+
+    The pool is created closed, open it with `await pool.open(wait=True)` inside a running loop.
+    Broken connections are dropped by the checkout check and replaced by the pool in the background,
+    so a database restart only fails the requests in flight at that moment.
+    """
+    pool = AsyncConnectionPool(
+        conninfo=conninfo,
+        name=name,
+        min_size=int(getenv(f"{env_prefix}_POOL_MIN_SIZE", "2")),
+        max_size=int(getenv(f"{env_prefix}_POOL_MAX_SIZE", "20")),
+        # how long a request waits for a free connection before failing
+        timeout=float(getenv(f"{env_prefix}_POOL_TIMEOUT", "10")),
+        max_idle=float(getenv(f"{env_prefix}_POOL_MAX_IDLE", "300")),
+        max_lifetime=float(getenv(f"{env_prefix}_POOL_MAX_LIFETIME", "3600")),
+        reconnect_timeout=float(getenv(f"{env_prefix}_POOL_RECONNECT_TIMEOUT", "300")),
+        check=AsyncConnectionPool.check_connection,
+        kwargs=connection_kwargs,
+        open=False,
+    )
+    register_pool_metrics(name, pool)
+    return pool
@@ -0,0 +1,98 @@
+import threading
+from os import getenv
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.dialects.postgresql import JSONB
+
+# PGVector creates its table classes and the collection row on construction, neither is safe to race
+_init_lock = threading.Lock()
+
+
+class PgDocumentStore:
+    """Chunk level bookkeeping for documents stored in a PGVector collection.
+
+    Every chunk row carries document_key and document_hash in its metadata so a document
+    can be diffed against what is already indexed.
+    """
+
+    def __init__(self, collection_name: str, connection: str, embeddings: Embeddings):
+        # imported on first ingestion, langchain_postgres is slow to import
+        from langchain_postgres import PGVector
+        from util.clients import get_ingestion_engine
+        with _init_lock:
+            self.vector_store = PGVector(
+                embeddings=embeddings,
+                collection_name=collection_name,
+                # one connection pool for all jobs instead of an engine per upload
+                connection=get_ingestion_engine(connection),
+                use_jsonb=True,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # every statement commits on its own
+        return None
+
+    def _collection_id(self, session):
+        collection = self.vector_store.get_collection(session)
+        if not collection:
+            raise ValueError("Collection not found")
+        return collection.uuid
+
+    def document_chunks(self, document_key: str) -> Dict[str, Optional[str]]:
+        """Return {chunk id: document hash} for every chunk indexed under document_key"""
+        store = self.vector_store.EmbeddingStore
+        with self.vector_store._make_sync_session() as session:
+            rows = session.execute(
+                select(store.id, store.cmetadata["document_hash"].astext).where(
+                    store.collection_id == self._collection_id(session),
+                    store.cmetadata["document_key"].astext == document_key,
+                )
+            ).all()
+        return {row[0]: row[1] for row in rows}
+
+    def add(self, texts: List[str], vectors: List[List[float]], metadatas: List[dict], ids: List[str]):
+        self.vector_store.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids: List[str]):
+        if ids:
+            store = self.vector_store.EmbeddingStore
+            with self.vector_store._make_sync_session() as session:
+                session.execute(delete(store).where(
+                    store.collection_id == self._collection_id(session),
+                    store.id.in_(ids),
+                ))
+                session.commit()
+
+    def set_document_hash(self, document_key: str, document_hash: str):
+        """Stamp the current document hash on all of its chunks, including ones kept from earlier uploads"""
+        store = self.vector_store.EmbeddingStore
+        with self.vector_store._make_sync_session() as session:
+            session.execute(
+                update(store)
+                .where(
+                    store.collection_id == self._collection_id(session),
+                    store.cmetadata["document_key"].astext == document_key,
+                )
+                .values(cmetadata=store.cmetadata.op("||", return_type=JSONB)(
+                    literal({"document_hash": document_hash}, type_=JSONB)
+                ))
+            )
+            session.commit()
+
+
+def create_document_store(collection_name: str, connection: str, embeddings: Embeddings):
+    """Ingestion store for the configured VECTOR_STORE_BACKEND (pgvector or local)"""
+    if getenv("VECTOR_STORE_BACKEND", "pgvector") == "local":
+        from util.local_vector_index import LocalDocumentStore
+        return LocalDocumentStore(
+            collection_name,
+            getenv("LOCAL_VECTOR_INDEX_DIR", ".cache/vector_index"),
+            ivf_min_rows=int(getenv("LOCAL_VECTOR_INDEX_IVF_MIN_ROWS", "20000")),
+            max_rows=int(getenv("LOCAL_VECTOR_INDEX_MAX_ROWS", "100000")),
+        )
+    return PgDocumentStore(collection_name, connection, embeddings)
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from os import getenv
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from util.metrics import EMBEDDING_CACHE_ENTRIES, EMBEDDING_CACHE_LOOKUPS
+from util.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so formatting-only differences share a cache entry"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingDiskCache:
+    """SQLite backed store of float32 embeddings keyed by content hash"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # stay below sqlite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an in-memory LRU front tier and an on-disk back tier.
+
+    Entries are keyed by (model name, hash of normalized text), so the same chunk or query
+    is only ever sent to the embeddings API once.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_memory_entries: int = 10000,
+                 disk_path: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.disk = EmbeddingDiskCache(disk_path) if disk_path else None
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._query_flights = SingleFlight("query_embedding")
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _memory_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+        EMBEDDING_CACHE_LOOKUPS.labels(result="memory_hit").inc(len(found))
+        return found
+
+    def _memory_put(self, items: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in items.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+            EMBEDDING_CACHE_ENTRIES.set(len(self._memory))
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not self.disk or not keys:
+            return {}
+        found = self.disk.get_many(keys)
+        EMBEDDING_CACHE_LOOKUPS.labels(result="disk_hit").inc(len(found))
+        self._memory_put(found)
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        self._memory_put(items)
+        if self.disk:
+            self.disk.put_many(items)
+
+    def _missing_texts(self, texts: List[str], keys: List[str], found: Dict[str, List[float]]) -> Dict[str, str]:
+        # dedupe identical texts within a request, they only need one API call
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in found and key not in missing:
+                missing[key] = text
+        EMBEDDING_CACHE_LOOKUPS.labels(result="miss").inc(len(missing))
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        found = self._memory_get(keys)
+        found.update(self._disk_get([key for key in keys if key not in found]))
+
+        missing = self._missing_texts(texts, keys, found)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        found = self._memory_get([key]) or self._disk_get([key])
+        if found:
+            return found[key]
+
+        self._missing_texts([text], [key], found)
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        found = self._memory_get(keys)
+        found.update(await asyncio.to_thread(self._disk_get, [key for key in keys if key not in found]))
+
+        missing = self._missing_texts(texts, keys, found)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._store, computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        found = self._memory_get([key]) or await asyncio.to_thread(self._disk_get, [key])
+        if found:
+            return found[key]
+
+        async def embed():
+            self._missing_texts([text], [key], found)
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._store, {key: vector})
+            return vector
+
+        # sessions asking the same question at once share one embeddings request
+        return await self._query_flights.run(key, embed)
+
+
+_cached_embeddings: Optional[CachedEmbeddings] = None
+_init_lock = threading.Lock()
+
+
+def get_cached_embeddings() -> CachedEmbeddings:
+    """Process wide embeddings client shared by ingestion and retrieval"""
+    global _cached_embeddings
+    with _init_lock:
+        if _cached_embeddings is None:
+            load_dotenv()
+            embeddings = OpenAIEmbeddings()
+            _cached_embeddings = CachedEmbeddings(
+                embeddings=embeddings,
+                model_name=embeddings.model,
+                max_memory_entries=int(getenv("EMBEDDING_CACHE_SIZE", "10000")),
+                disk_path=getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite") or None,
+            )
+        return _cached_embeddings
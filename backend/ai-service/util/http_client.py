@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from os import getenv
+from typing import Optional, Dict, Any
+
+import httpx
+from dotenv import load_dotenv
+
+from util.metrics import EXTERNAL_API_SECONDS
+from util.tracing import span
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+
+class ExternalApiClient:
+    """Shared keep-alive client for the NestJS backend API"""
+
+    def __init__(self, base_url: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        load_dotenv()
+        pool_size = int(getenv("EXTERNAL_API_POOL_SIZE", "20"))
+        self.max_retries = int(getenv("EXTERNAL_API_MAX_RETRIES", "2"))
+        self.retry_backoff = float(getenv("EXTERNAL_API_RETRY_BACKOFF", "0.2"))
+
+        self.client = httpx.AsyncClient(
+            base_url=base_url or getenv("EXTERNAL_API_BASE_URL", ""),
+            timeout=httpx.Timeout(
+                connect=float(getenv("EXTERNAL_API_CONNECT_TIMEOUT", "2")),
+                read=float(getenv("EXTERNAL_API_READ_TIMEOUT", "10")),
+                write=float(getenv("EXTERNAL_API_WRITE_TIMEOUT", "10")),
+                # waiting for a free connection from the pool
+                pool=float(getenv("EXTERNAL_API_POOL_TIMEOUT", "2")),
+            ),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+            transport=transport,
+        )
+
+    async def request(
+            self,
+            method: str,
+            path: str,
+            token: Optional[str] = None,
+            json: Optional[Dict[str, Any]] = None,
+            idempotent: Optional[bool] = None,
+    ) -> httpx.Response:
+        """Send a request, retrying idempotent calls on connection errors and retryable status codes"""
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+        attempts = self.max_retries + 1 if idempotent else 1
+
+        started = time.perf_counter()
+        status = "error"
+        try:
+            for attempt in range(attempts):
+                try:
+                    with span("http", method=method, path=path, attempt=attempt) as request_span:
+                        response = await self.client.request(method, path, json=json, headers=headers)
+                        if request_span.recording:
+                            request_span.set(status=response.status_code, response_bytes=len(response.content),
+                                             request_bytes=len(response.request.content))
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt == attempts - 1:
+                        status = str(response.status_code)
+                        return response
+                    logger.warning(f"{method} {path} returned {response.status_code}, retrying")
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
+                    if attempt == attempts - 1:
+                        raise
+                    logger.warning(f"{method} {path} failed with {e!r}, retrying")
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+        finally:
+            EXTERNAL_API_SECONDS.labels(method=method, path=path, status=status).observe(time.perf_counter() - started)
+
+    async def get(self, path: str, token: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, token=token, **kwargs)
+
+    async def post(self, path: str, token: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, token=token, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client: Optional[ExternalApiClient] = None
+
+
+async def init_http_client(base_url: Optional[str] = None,
+                           transport: Optional[httpx.AsyncBaseTransport] = None) -> ExternalApiClient:
+    """Create the shared client, called from the FastAPI lifespan"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = ExternalApiClient(base_url=base_url, transport=transport)
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> ExternalApiClient:
+    """Return the shared client, creating it lazily when used outside the app (scripts, notebooks)"""
+    global _client
+    if _client is None:
+        _client = ExternalApiClient()
+    return _client
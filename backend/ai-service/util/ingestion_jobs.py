@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from os import getenv
+from typing import Dict, Any, Literal, Optional, Tuple
+
+from pydantic import BaseModel
+
+from util.answer_cache import invalidate_answer_caches
+from util.pdf_processor import PdfDocumentEmbedder
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJob(BaseModel):
+    """Status of a single document ingestion"""
+    id: str
+    filename: str
+    file_path: str
+    document_key: str
+    status: Literal["queued", "running", "completed", "failed"] = "queued"
+    pages_parsed: int = 0
+    chunks_embedded: int = 0
+    rows_written: int = 0
+    chunks_unchanged: int = 0
+    rows_deleted: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class IngestionJobManager:
+    """Runs document ingestion jobs on a bounded pool of background workers.
+
+    The queue, the job statuses and the per-document locks live in this process, so the service has to
+    run as a single worker process: with several, a job status is only found on the worker that took
+    the upload, and two versions of one document could be ingested at the same time.
+    """
+
+    def __init__(self, collection_name: str, workers: Optional[int] = None,
+                 max_queued: Optional[int] = None, max_history: Optional[int] = None):
+        self.collection_name = collection_name
+        self.workers = workers or int(getenv("INGEST_WORKERS", "2"))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued or int(getenv("INGEST_MAX_QUEUED", "50")))
+        self.max_history = max_history or int(getenv("INGEST_JOB_HISTORY", "500"))
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._tasks = []
+        # versions of the same document must be diffed one after another, lock and jobs holding or waiting on it
+        self._document_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, file_path: str, filename: str, document_key: Optional[str] = None,
+               content_hash: Optional[str] = None) -> IngestionJob:
+        """Queue a document for ingestion.
+
+        Only an explicit document_key replaces an earlier upload. Without one the key is derived from
+        the content, so different files sharing a filename are both kept and an identical re-upload
+        is skipped as unchanged.
+        """
+        job_id = str(uuid.uuid4())
+        job = IngestionJob(
+            id=job_id,
+            filename=filename,
+            file_path=file_path,
+            document_key=document_key or (f"sha256:{content_hash}" if content_hash else job_id),
+            created_at=datetime.now(timezone.utc),
+        )
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestionQueueFull("Too many documents waiting for ingestion, try again later")
+
+        self.jobs[job.id] = job
+        self._evict_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.jobs.get(job_id)
+
+    def _evict_finished(self):
+        # keep status of recent jobs only, never drop jobs still in flight
+        for job_id in list(self.jobs.keys()):
+            if len(self.jobs) <= self.max_history:
+                break
+            if self.jobs[job_id].status in ("completed", "failed"):
+                del self.jobs[job_id]
+
+    @asynccontextmanager
+    async def _document_lock(self, document_key: str):
+        lock, users = self._document_locks.get(document_key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._document_locks[document_key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._document_locks[document_key]
+            if users == 1:
+                del self._document_locks[document_key]
+            else:
+                self._document_locks[document_key] = (lock, users - 1)
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                async with self._document_lock(job.document_key):
+                    job.status = "running"
+                    job.started_at = datetime.now(timezone.utc)
+                    logger.info(f"Ingestion worker {worker_id} started job {job.id} ({job.filename})")
+                    # parsing, embedding and inserting are all blocking, keep them off the event loop
+                    job.result = await asyncio.to_thread(self._run, job, loop)
+                job.status = "completed"
+                if job.result.get("chunks_added") or job.result.get("chunks_deleted"):
+                    invalidate_answer_caches(self.collection_name)
+                logger.info(f"Ingestion job {job.id} completed: {job.result}")
+            except Exception as e:
+                logger.error(f"Ingestion job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.now(timezone.utc)
+                self.queue.task_done()
+
+    @staticmethod
+    def _advance(job: IngestionJob, stage: str, count: int):
+        setattr(job, stage, getattr(job, stage) + count)
+
+    def _run(self, job: IngestionJob, loop: asyncio.AbstractEventLoop) -> Dict[str, Any]:
+        def on_progress(stage: str, count: int):
+            # reported from ingestion threads, the job is only ever updated on the event loop
+            loop.call_soon_threadsafe(self._advance, job, stage, count)
+
+        pdf_embedder = PdfDocumentEmbedder(file_path=job.file_path)
+        return pdf_embedder.insert_into_db(self.collection_name, on_progress=on_progress,
+                                           document_key=job.document_key)
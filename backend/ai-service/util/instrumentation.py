@@ -0,0 +1,140 @@
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+from util.metrics import (CHECKPOINT_SECONDS, GRAPH_NODE_SECONDS, LLM_CALL_SECONDS, LLM_CALL_TOKENS,
+                          STARTUP_PHASE_SECONDS)
+from util.tracing import get_tracer, span
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block, labelled with outcome ok/error"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - started)
+
+
+def timed_node(name: str, node):
+    """Wrap a graph node (or routing function) so every execution is recorded in graph_node_seconds"""
+
+    @functools.wraps(node)
+    async def wrapper(state):
+        with timed(GRAPH_NODE_SECONDS, node=name), span(f"node {name}"):
+            return await node(state)
+
+    return wrapper
+
+
+class StartupTimer:
+    """Times the named phases of startup, reported as one log line and the startup_phase_seconds gauge"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+            STARTUP_PHASE_SECONDS.labels(phase=name).set(self.phases[name])
+
+    def report(self, title: str = "Startup"):
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        logger.info(f"{title} took {sum(self.phases.values()):.3f}s ({phases})")
+
+
+class LlmMetricsCallback(BaseCallbackHandler):
+    """Records latency and token usage of every chat model call made by an agent, and its trace span"""
+
+    # only bookkeeping, no need to hop to a thread for it
+    run_inline = True
+
+    def __init__(self, agent: str):
+        self.agent = agent
+        self._runs: Dict[UUID, tuple] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or "unknown"
+        llm_span = get_tracer().start_span("llm", agent=self.agent, model=model)
+        if llm_span.recording:
+            llm_span.set(prompt_chars=sum(len(str(message.content)) for batch in messages for message in batch))
+        self._runs[run_id] = (model, time.perf_counter(), llm_span)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        model, started, llm_span = run
+        LLM_CALL_SECONDS.labels(agent=self.agent, model=model, outcome="ok").observe(time.perf_counter() - started)
+
+        usage = None
+        generations = response.generations[0] if response.generations else []
+        message = getattr(generations[0], "message", None) if generations else None
+        if message is not None and getattr(message, "usage_metadata", None):
+            usage = {"prompt": message.usage_metadata.get("input_tokens", 0),
+                     "completion": message.usage_metadata.get("output_tokens", 0)}
+        elif response.llm_output and response.llm_output.get("token_usage"):
+            token_usage = response.llm_output["token_usage"]
+            usage = {"prompt": token_usage.get("prompt_tokens", 0),
+                     "completion": token_usage.get("completion_tokens", 0)}
+        if usage:
+            for kind, count in usage.items():
+                LLM_CALL_TOKENS.labels(agent=self.agent, model=model, kind=kind).observe(count)
+        if llm_span.recording:
+            llm_span.set(prompt_tokens=(usage or {}).get("prompt"), completion_tokens=(usage or {}).get("completion"),
+                         completion_chars=sum(len(generation.text) for generation in generations))
+        llm_span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            model, started, llm_span = run
+            LLM_CALL_SECONDS.labels(agent=self.agent, model=model, outcome="error").observe(time.perf_counter() - started)
+            llm_span.set(error=repr(error))
+            llm_span.end("error")
+
+
+def payload_size(value) -> int:
+    """Approximate serialized size in bytes, only computed for sampled spans"""
+    return len(json.dumps(value, default=str))
+
+
+class InstrumentedPostgresSaver(AsyncPostgresSaver):
+    """AsyncPostgresSaver that records checkpoint read and write latency"""
+
+    async def aget_tuple(self, config):
+        with timed(CHECKPOINT_SECONDS, operation="get"), span("checkpoint get") as checkpoint_span:
+            result = await super().aget_tuple(config)
+            if checkpoint_span.recording:
+                checkpoint_span.set(found=result is not None,
+                                    bytes=payload_size(result.checkpoint) if result is not None else 0)
+            return result
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with timed(CHECKPOINT_SECONDS, operation="put"), span("checkpoint put") as checkpoint_span:
+            if checkpoint_span.recording:
+                checkpoint_span.set(bytes=payload_size(checkpoint), channels=len(new_versions))
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with timed(CHECKPOINT_SECONDS, operation="put_writes"), span("checkpoint put_writes") as checkpoint_span:
+            if checkpoint_span.recording:
+                checkpoint_span.set(writes=len(writes), bytes=payload_size(writes))
+            return await super().aput_writes(config, writes, task_id, task_path)
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from os import getenv
+from typing import Dict, List, Optional
+
+import openai
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+
+from util.context_manager import count_tokens
+from util.metrics import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS, LLM_RETRIES, LLM_SHED
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError)
+
+
+class LlmOverloaded(Exception):
+    """Raised instead of queueing a chat model call when the scheduler is saturated"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at tokens_per_minute, callers are served in arrival order"""
+
+    def __init__(self, tokens_per_minute: float):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        # a prompt larger than the bucket waits for a full bucket instead of forever
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            if self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+def _parse_model_limits(spec: str) -> Dict[str, int]:
+    """"gpt-4o=8,gpt-4o-mini=16" -> {"gpt-4o": 8, "gpt-4o-mini": 16}"""
+    limits = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, limit = part.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Delay asked for by the provider in the retry-after-ms or retry-after header, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class LlmScheduler:
+    """Admission control for every chat model call made by the agents.
+
+    A call waits for a global and a per-model concurrency slot and for prompt tokens from the model's
+    token bucket. Rate limit responses pause the whole model until its Retry-After has passed, so
+    queued calls back off together instead of each hitting the 429. With max_queue calls already
+    waiting, or after waiting queue_timeout, the call fails fast with LlmOverloaded.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, model_concurrency: Optional[Dict[str, int]] = None,
+                 max_queue: Optional[int] = None, queue_timeout: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_retries: Optional[int] = None):
+        self.max_concurrency = max_concurrency or int(getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.model_concurrency = model_concurrency if model_concurrency is not None else \
+            _parse_model_limits(getenv("LLM_MODEL_CONCURRENCY", ""))
+        self.max_queue = max_queue if max_queue is not None else int(getenv("LLM_MAX_QUEUE", "200"))
+        self.queue_timeout = queue_timeout or float(getenv("LLM_QUEUE_TIMEOUT", "15"))
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else \
+            float(getenv("LLM_TOKENS_PER_MINUTE", "0"))
+        self.max_retries = max_retries if max_retries is not None else int(getenv("LLM_MAX_RETRIES", "3"))
+        self.backoff_base = float(getenv("LLM_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(getenv("LLM_BACKOFF_MAX", "30"))
+        self._global = asyncio.Semaphore(self.max_concurrency)
+        self._models: Dict[str, asyncio.Semaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._paused_until: Dict[str, float] = {}
+        self.waiting = 0
+
+    def overloaded(self) -> bool:
+        """True when new chat requests should be turned away before they queue any LLM calls"""
+        return self.waiting >= self.max_queue
+
+    def _model_semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._models:
+            self._models[model] = asyncio.Semaphore(self.model_concurrency.get(model, self.max_concurrency))
+        return self._models[model]
+
+    async def _acquire(self, model: str, tokens: int):
+        while (pause := self._paused_until.get(model, 0) - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+        if self.tokens_per_minute > 0:
+            if model not in self._buckets:
+                self._buckets[model] = TokenBucket(self.tokens_per_minute)
+            await self._buckets[model].acquire(tokens)
+        model_semaphore = self._model_semaphore(model)
+        await model_semaphore.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            model_semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int):
+        if self.overloaded():
+            LLM_SHED.labels(reason="queue_full").inc()
+            raise LlmOverloaded(f"LLM queue is full ({self.waiting} calls waiting)", retry_after=self.backoff_base * 4)
+        started = time.perf_counter()
+        self.waiting += 1
+        LLM_QUEUE_DEPTH.labels(model=model).inc()
+        try:
+            await asyncio.wait_for(self._acquire(model, tokens), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            LLM_SHED.labels(reason="queue_timeout").inc()
+            raise LlmOverloaded(f"No LLM capacity for {model} within {self.queue_timeout}s",
+                                retry_after=self.queue_timeout)
+        finally:
+            self.waiting -= 1
+            LLM_QUEUE_DEPTH.labels(model=model).dec()
+            LLM_QUEUE_WAIT_SECONDS.labels(model=model).observe(time.perf_counter() - started)
+        LLM_IN_FLIGHT.labels(model=model).inc()
+        try:
+            yield
+        finally:
+            LLM_IN_FLIGHT.labels(model=model).dec()
+            self._global.release()
+            self._model_semaphore(model).release()
+
+    async def backoff(self, model: str, error: BaseException, attempt: int):
+        """Sleep before retrying a failed call, a rate limit also pauses every other call to the model"""
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # full jitter so calls that failed together do not retry together
+            delay = random.uniform(0, self.backoff_base * 2 ** attempt)
+        delay = min(delay, self.backoff_max)
+        rate_limited = isinstance(error, openai.RateLimitError)
+        LLM_RETRIES.labels(model=model, reason="rate_limit" if rate_limited else "error").inc()
+        if rate_limited:
+            self._paused_until[model] = max(self._paused_until.get(model, 0), time.monotonic() + delay)
+        logger.warning(f"LLM call to {model} failed ({error.__class__.__name__}), "
+                       f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+def estimate_prompt_tokens(messages: List[BaseMessage]) -> int:
+    # a few tokens of per message overhead on top of the content
+    return sum(count_tokens(str(message.content)) + 4 for message in messages)
+
+
+_scheduler: Optional[LlmScheduler] = None
+
+
+def get_llm_scheduler() -> LlmScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LlmScheduler()
+    return _scheduler
+
+
+class ScheduledChatModel:
+    """Chat model mixin sending every request through the shared LlmScheduler, which also owns the retries.
+
+    Goes in front of a chat model class with a model_name, e.g. ScheduledChatOpenAI below.
+    """
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if getattr(self, "streaming", False):
+            # generated from _astream, which is scheduled itself
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        scheduler = get_llm_scheduler()
+        tokens = estimate_prompt_tokens(messages)
+        attempt = 0
+        while True:
+            try:
+                async with scheduler.slot(self.model_name, tokens):
+                    return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= scheduler.max_retries:
+                    raise
+                await scheduler.backoff(self.model_name, e, attempt)
+                attempt += 1
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = get_llm_scheduler()
+        tokens = estimate_prompt_tokens(messages)
+        attempt = 0
+        while True:
+            streamed = False
+            try:
+                async with scheduler.slot(self.model_name, tokens):
+                    async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        streamed = True
+                        yield chunk
+                return
+            except RETRYABLE_ERRORS as e:
+                # tokens already sent to the client cannot be taken back
+                if streamed or attempt >= scheduler.max_retries:
+                    raise
+                await scheduler.backoff(self.model_name, e, attempt)
+                attempt += 1
+
+
+class ScheduledChatOpenAI(ScheduledChatModel, ChatOpenAI):
+    """ChatOpenAI whose requests go through the shared LlmScheduler"""
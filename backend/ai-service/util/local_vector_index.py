@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from util.answer_cache import invalidate_answer_caches
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+IVF_FILE = "ivf.npz"
+KEEP_VERSIONS = 2
+
+
+class Snapshot:
+    """One immutable version of a collection: a float32 matrix of unit vectors plus a metadata sidecar"""
+
+    def __init__(self, version: Optional[str], ids: List[str], texts: List[str], metadatas: List[dict],
+                 matrix: np.ndarray, ivf: Optional["IvfIndex"] = None):
+        self.version = version
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.ivf = ivf
+
+    @classmethod
+    def empty(cls) -> "Snapshot":
+        return cls(None, [], [], [], np.zeros((0, 0), dtype=np.float32))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+class IvfIndex:
+    """Inverted file index: rows are stored grouped by their nearest centroid and only the
+    nprobe closest groups are scanned at query time"""
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        # rows of list c are matrix[offsets[c]:offsets[c + 1]]
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, iterations: int = 8, sample_size: int = 20000,
+              seed: int = 0) -> Tuple["IvfIndex", np.ndarray]:
+        """Cluster the rows, returns the index and the row order the matrix has to be stored in"""
+        rng = np.random.default_rng(seed)
+        lists = max(1, int(np.sqrt(len(matrix))))
+        sample = matrix[rng.choice(len(matrix), size=min(sample_size, len(matrix)), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+        # spherical k-means, rows are unit vectors so nearest centroid = highest dot product
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+
+        assignment = np.concatenate([
+            np.argmax(matrix[start:start + 10000] @ centroids.T, axis=1)
+            for start in range(0, len(matrix), 10000)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+        return cls(centroids, offsets), order
+
+    def ranges(self, query: np.ndarray, nprobe: int) -> List[Tuple[int, int]]:
+        nprobe = min(nprobe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in closest]
+
+
+def current_version(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(path: str, mmap: bool = True) -> Snapshot:
+    version = current_version(path)
+    if version is None:
+        return Snapshot.empty()
+    version_dir = os.path.join(path, version)
+    with open(os.path.join(version_dir, METADATA_FILE), encoding="utf-8") as f:
+        sidecar = json.load(f)
+    matrix = np.load(os.path.join(version_dir, EMBEDDINGS_FILE), mmap_mode="r" if mmap else None)
+    ivf = None
+    ivf_path = os.path.join(version_dir, IVF_FILE)
+    if os.path.exists(ivf_path):
+        with np.load(ivf_path) as data:
+            ivf = IvfIndex(data["centroids"], data["offsets"])
+    return Snapshot(version, sidecar["ids"], sidecar["texts"], sidecar["metadatas"], matrix, ivf)
+
+
+def write_snapshot(path: str, ids: List[str], texts: List[str], metadatas: List[dict], matrix: np.ndarray,
+                   ivf_min_rows: int = 0) -> str:
+    """Write a new version next to the current one and atomically point CURRENT at it.
+
+    Collections with at least ivf_min_rows chunks (when set) also get an approximate IVF index.
+    """
+    os.makedirs(path, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(path, version)
+    os.makedirs(version_dir)
+    matrix = matrix.astype(np.float32)
+    if ivf_min_rows and len(matrix) >= ivf_min_rows:
+        ivf, order = IvfIndex.build(matrix)
+        # store rows grouped by list so a probe reads one contiguous slice
+        matrix = matrix[order]
+        ids = [ids[i] for i in order]
+        texts = [texts[i] for i in order]
+        metadatas = [metadatas[i] for i in order]
+        np.savez(os.path.join(version_dir, IVF_FILE), centroids=ivf.centroids, offsets=ivf.offsets)
+    np.save(os.path.join(version_dir, EMBEDDINGS_FILE), matrix)
+    with open(os.path.join(version_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f)
+
+    tmp_current = os.path.join(path, f"{CURRENT_FILE}.tmp")
+    with open(tmp_current, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_current, os.path.join(path, CURRENT_FILE))
+
+    # readers may still have the previous version mapped, keep it around for a while
+    versions = sorted(name for name in os.listdir(path) if name.startswith("v"))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return version
+
+
+# one writer per collection directory within the process
+_write_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+class LocalIndexFull(Exception):
+    pass
+
+
+class LocalDocumentStore:
+    """Ingestion side of the local index, same interface as PgDocumentStore.
+
+    Changes are staged in memory while the store is entered and published as a new snapshot on exit.
+    Every upload reads and rewrites the whole collection, so the local backend is meant for small
+    corpora: ingestion fails with LocalIndexFull once a collection would exceed max_rows chunks,
+    larger knowledge bases belong in pgvector.
+    """
+
+    def __init__(self, collection_name: str, index_dir: str, ivf_min_rows: int = 0, max_rows: int = 0):
+        self.path = os.path.join(index_dir, collection_name)
+        self.ivf_min_rows = ivf_min_rows
+        self.max_rows = max_rows
+        self._lock = _write_locks[os.path.abspath(self.path)]
+        self.records: Dict[str, Tuple[str, dict, np.ndarray]] = {}
+        self._dirty = False
+
+    def __enter__(self):
+        self._lock.acquire()
+        snapshot = load_snapshot(self.path, mmap=False)
+        self.records = {
+            chunk_id: (text, metadata, snapshot.matrix[i])
+            for i, (chunk_id, text, metadata) in enumerate(zip(snapshot.ids, snapshot.texts, snapshot.metadatas))
+        }
+        self._dirty = False
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and self._dirty:
+                ids = list(self.records.keys())
+                matrix = np.stack([self.records[i][2] for i in ids]) if ids else np.zeros((0, 0), dtype=np.float32)
+                version = write_snapshot(
+                    self.path,
+                    ids,
+                    [self.records[i][0] for i in ids],
+                    [self.records[i][1] for i in ids],
+                    matrix,
+                    ivf_min_rows=self.ivf_min_rows,
+                )
+                logger.info(f"Published local vector index {self.path} version {version} ({len(ids)} chunks)")
+        finally:
+            self.records = {}
+            self._lock.release()
+
+    def document_chunks(self, document_key: str) -> Dict[str, Optional[str]]:
+        return {
+            chunk_id: metadata.get("document_hash")
+            for chunk_id, (_, metadata, _) in self.records.items()
+            if metadata.get("document_key") == document_key
+        }
+
+    def add(self, texts: List[str], vectors: List[List[float]], metadatas: List[dict], ids: List[str]):
+        if self.max_rows and len(self.records) + len(ids) > self.max_rows:
+            raise LocalIndexFull(f"Local vector index {self.path} is limited to {self.max_rows} chunks, "
+                                 f"use the pgvector backend for larger knowledge bases")
+        normalized = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        for chunk_id, text, metadata, vector in zip(ids, texts, metadatas, normalized):
+            self.records[chunk_id] = (text, metadata, vector)
+        self._dirty = True
+
+    def delete(self, ids: List[str]):
+        for chunk_id in ids:
+            if self.records.pop(chunk_id, None) is not None:
+                self._dirty = True
+
+    def set_document_hash(self, document_key: str, document_hash: str):
+        for chunk_id, (text, metadata, vector) in self.records.items():
+            if metadata.get("document_key") == document_key and metadata.get("document_hash") != document_hash:
+                self.records[chunk_id] = (text, {**metadata, "document_hash": document_hash}, vector)
+                self._dirty = True
+
+
+class LocalVectorIndex:
+    """Query side of the local index: cosine top-k over a memory-mapped matrix, exact by default
+    and approximate (IVF) for snapshots that were published with an IVF index.
+
+    The snapshot pointer is re-checked at most every reload_interval seconds and a newly
+    published version is swapped in atomically, readers never see a half written index.
+    """
+
+    def __init__(self, collection_name: str, index_dir: str, reload_interval: float = 1.0, nprobe: int = 8):
+        self.collection_name = collection_name
+        self.path = os.path.join(index_dir, collection_name)
+        self.reload_interval = reload_interval
+        self.nprobe = nprobe
+        self._snapshot = Snapshot.empty()
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def _needs_reload(self) -> bool:
+        return time.monotonic() - self._checked_at >= self.reload_interval
+
+    def reload(self):
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            version = current_version(self.path)
+            if version == self._snapshot.version:
+                return
+            snapshot = load_snapshot(self.path)
+            had_snapshot = self._snapshot.version is not None
+            self._snapshot = snapshot
+        logger.info(f"Loaded local vector index {self.collection_name} version {version} ({len(snapshot.ids)} chunks)")
+        if had_snapshot:
+            invalidate_answer_caches(self.collection_name)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        if self._needs_reload():
+            self.reload()
+        snapshot = self._snapshot
+        if not snapshot.ids:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        if snapshot.ivf is not None:
+            ranges = snapshot.ivf.ranges(query, self.nprobe)
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([snapshot.matrix[start:end] @ query for start, end in ranges])
+        else:
+            rows = None
+            scores = snapshot.matrix @ query
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            top = rows[top]
+        return [
+            Document(id=snapshot.ids[i], page_content=snapshot.texts[i], metadata=snapshot.metadatas[i])
+            for i in top
+        ]
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        if self._needs_reload():
+            await asyncio.to_thread(self.reload)
+        return self.similarity_search_by_vector(embedding, k=k)
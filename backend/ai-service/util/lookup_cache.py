@@ -0,0 +1,126 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from os import getenv
+from typing import Any, Dict, Optional, Tuple
+
+from util.metrics import LOOKUP_CACHE_ENTRIES, LOOKUP_CACHE_INVALIDATIONS, LOOKUP_CACHE_REQUESTS, \
+    LOOKUP_CACHE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# seconds a lookup result is served from the cache, per tool
+DEFAULT_TTLS = {
+    "get_user_policy_details": 120.0,
+    "get_claim_details": 30.0,
+}
+
+
+@dataclass
+class CachedLookup:
+    value: Any
+    # how long the backend call took, credited as saved time on every hit
+    cost_seconds: float
+    expires_at: float
+
+
+def caller_key(token: str) -> str:
+    """Cache identity of the caller, a hash of the full bearer token.
+
+    The token is not decoded, an unverified user id would let a forged token read another user's
+    cached data. A refreshed token therefore starts with an empty cache.
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class LookupCache:
+    """Read-through cache for the read-only customer data lookups of the API agent.
+
+    Entries are keyed by caller, tool and arguments, expire after the tool's TTL
+    (LOOKUP_CACHE_TTL_<TOOL>) and the least recently used entry is evicted past max_entries.
+    A caller's entries are dropped as soon as they submit a claim.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, max_entries: Optional[int] = None):
+        self.enabled = getenv("LOOKUP_CACHE_ENABLED", "true").lower() == "true"
+        self.ttls = ttls if ttls is not None else {
+            tool: float(getenv(f"LOOKUP_CACHE_TTL_{tool.upper()}", str(ttl))) for tool, ttl in DEFAULT_TTLS.items()
+        }
+        self.max_entries = max_entries or int(getenv("LOOKUP_CACHE_SIZE", "5000"))
+        self._entries: "OrderedDict[Tuple[str, str, str], CachedLookup]" = OrderedDict()
+        self._invalidated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(tool: str, token: str, args: Dict[str, Any]) -> Tuple[str, str, str]:
+        return caller_key(token), tool, json.dumps(args, sort_keys=True, default=str)
+
+    def _cacheable(self, tool: str, token: Optional[str]) -> bool:
+        return self.enabled and bool(token) and self.ttls.get(tool, 0) > 0
+
+    def get(self, tool: str, token: Optional[str], **args) -> Optional[Any]:
+        if not self._cacheable(tool, token):
+            return None
+        key = self._key(tool, token, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                LOOKUP_CACHE_ENTRIES.set(len(self._entries))
+                entry = None
+            if entry is None:
+                LOOKUP_CACHE_REQUESTS.labels(tool=tool, result="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+        LOOKUP_CACHE_REQUESTS.labels(tool=tool, result="hit").inc()
+        LOOKUP_CACHE_SAVED_SECONDS.labels(tool=tool).inc(entry.cost_seconds)
+        # callers put results into the graph state, never hand out the cached object itself
+        return copy.deepcopy(entry.value)
+
+    def put(self, tool: str, token: Optional[str], value: Any, cost_seconds: float, **args):
+        if not self._cacheable(tool, token):
+            return
+        key = self._key(tool, token, args)
+        with self._lock:
+            if self._invalidated_at.get(key[0], 0) > time.monotonic() - cost_seconds:
+                # the lookup started before the caller's last claim submission, its result may be stale
+                return
+            self._entries[key] = CachedLookup(
+                value=copy.deepcopy(value),
+                cost_seconds=cost_seconds,
+                expires_at=time.monotonic() + self.ttls[tool],
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            LOOKUP_CACHE_ENTRIES.set(len(self._entries))
+
+    def invalidate(self, token: Optional[str]):
+        """Drop every cached lookup of the caller, their policies and claims have just changed"""
+        if not token:
+            return
+        caller = caller_key(token)
+        with self._lock:
+            now = time.monotonic()
+            self._invalidated_at[caller] = now
+            # a marker only matters to lookups still in flight, keep them for the longest TTL at most
+            horizon = now - max(self.ttls.values(), default=0)
+            for stale_caller in [c for c, at in self._invalidated_at.items() if at < horizon]:
+                del self._invalidated_at[stale_caller]
+            stale = [key for key in self._entries if key[0] == caller]
+            for key in stale:
+                del self._entries[key]
+            LOOKUP_CACHE_ENTRIES.set(len(self._entries))
+        if stale:
+            LOOKUP_CACHE_INVALIDATIONS.inc(len(stale))
+            logger.info(f"Dropped {len(stale)} cached lookups after a claim submission")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated_at.clear()
+            LOOKUP_CACHE_ENTRIES.set(0)
@@ -0,0 +1,229 @@
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Semantic answer cache
+ANSWER_CACHE_LOOKUPS = Counter(
+    "answer_cache_lookups_total",
+    "Semantic answer cache lookups",
+    ["result"],
+)
+ANSWER_CACHE_SAVED_SECONDS = Counter(
+    "answer_cache_saved_seconds_total",
+    "Retrieval and generation time avoided by answer cache hits",
+)
+ANSWER_CACHE_ENTRIES = Gauge(
+    "answer_cache_entries",
+    "Entries currently held in the semantic answer cache",
+)
+ANSWER_CACHE_INVALIDATIONS = Counter(
+    "answer_cache_invalidations_total",
+    "Answer cache flushes caused by knowledge base changes",
+)
+
+# Embedding cache
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "embedding_cache_lookups_total",
+    "Texts looked up in the embedding cache by where they were found",
+    ["result"],
+)
+EMBEDDING_CACHE_ENTRIES = Gauge(
+    "embedding_cache_entries",
+    "Embeddings currently held in memory by the embedding cache",
+)
+
+
+class PoolStatsCollector:
+    """Exports psycopg pool statistics, read from the registered pools at scrape time"""
+
+    GAUGES = {
+        "pool_min": "Configured minimum connections",
+        "pool_max": "Configured maximum connections",
+        "pool_size": "Connections currently managed by the pool",
+        "pool_available": "Idle connections ready to be handed out",
+        "requests_waiting": "Requests currently waiting for a connection",
+    }
+    COUNTERS = {
+        "requests_num": "Connection requests served",
+        "requests_queued": "Connection requests that had to wait",
+        "requests_errors": "Connection requests that timed out or failed",
+        "connections_errors": "Failed connection attempts",
+        "connections_lost": "Connections found broken by the health check",
+    }
+
+    def __init__(self):
+        # keyed by pool name so re-creating a pool replaces the old one
+        self.pools = {}
+
+    def collect(self):
+        stats = {name: pool.get_stats() for name, pool in self.pools.items()}
+        for key, documentation in self.GAUGES.items():
+            family = GaugeMetricFamily(f"db_{key}", documentation, labels=["pool"])
+            for name, pool_stats in stats.items():
+                family.add_metric([name], pool_stats.get(key, 0))
+            yield family
+        for key, documentation in self.COUNTERS.items():
+            family = CounterMetricFamily(f"db_{key}", documentation, labels=["pool"])
+            for name, pool_stats in stats.items():
+                family.add_metric([name], pool_stats.get(key, 0))
+            yield family
+        wait = CounterMetricFamily("db_requests_wait_seconds", "Total time requests spent waiting for a connection",
+                                   labels=["pool"])
+        for name, pool_stats in stats.items():
+            wait.add_metric([name], pool_stats.get("requests_wait_ms", 0) / 1000)
+        yield wait
+
+
+POOL_STATS = PoolStatsCollector()
+REGISTRY.register(POOL_STATS)
+
+
+def register_pool_metrics(name: str, pool):
+    POOL_STATS.pools[name] = pool
+
+# Knowledge retrieval
+VECTOR_SEARCH_SECONDS = Histogram(
+    "vector_search_seconds",
+    "Latency of knowledge base vector searches, including the query embedding",
+    ["outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+# Prompt context compaction
+PROMPT_CONTEXT_TOKENS = Histogram(
+    "prompt_context_tokens",
+    "Tokens of AgentState.context rendered into a prompt, before and after compaction",
+    ["prompt", "stage"],
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+
+# Checkpoint retention
+CHECKPOINT_RETENTION_DELETED = Counter(
+    "checkpoint_retention_deleted_total",
+    "Rows (and whole threads) removed from the checkpoint tables by retention",
+    ["table"],
+)
+
+# Chat turn breakdown
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+GRAPH_NODE_SECONDS = Histogram(
+    "graph_node_seconds",
+    "Execution time of each LangGraph node",
+    ["node", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds",
+    "Latency of chat model calls",
+    ["agent", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_TOKENS = Histogram(
+    "llm_call_tokens",
+    "Prompt and completion tokens per chat model call",
+    ["agent", "model", "kind"],
+    buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+CHECKPOINT_SECONDS = Histogram(
+    "checkpoint_operation_seconds",
+    "Latency of checkpointer reads and writes",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_API_SECONDS = Histogram(
+    "external_api_request_seconds",
+    "Latency of backend API calls made by tools, including retries",
+    ["method", "path", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+TOOL_CALL_SECONDS = Histogram(
+    "tool_call_seconds",
+    "Execution time of API agent tools",
+    ["tool", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+ROUTING_DECISIONS = Counter(
+    "routing_decisions_total",
+    "Routing decisions by target agent and by the router that made them",
+    ["agent", "source"],
+)
+ERRORS = Counter(
+    "errors_total",
+    "Errors handled by the chat pipeline",
+    ["component"],
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    "startup_phase_seconds",
+    "Duration of each phase of the last service startup",
+    ["phase"],
+)
+
+# LLM scheduler
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "Chat model calls waiting for a scheduler slot",
+    ["model"],
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_in_flight",
+    "Chat model calls currently running",
+    ["model"],
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds",
+    "Time chat model calls waited for concurrency, rate limit and backoff",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "Chat model calls retried after a rate limit or transient error",
+    ["model", "reason"],
+)
+LLM_SHED = Counter(
+    "llm_shed_total",
+    "Chat model calls and chat requests rejected because the scheduler was saturated",
+    ["reason"],
+)
+
+# Customer data lookup cache
+LOOKUP_CACHE_REQUESTS = Counter(
+    "lookup_cache_requests_total",
+    "Read-only API tool lookups by cache result",
+    ["tool", "result"],
+)
+LOOKUP_CACHE_SAVED_SECONDS = Counter(
+    "lookup_cache_saved_seconds_total",
+    "Backend API time avoided by lookup cache hits",
+    ["tool"],
+)
+LOOKUP_CACHE_ENTRIES = Gauge(
+    "lookup_cache_entries",
+    "Entries currently held in the lookup cache",
+)
+LOOKUP_CACHE_INVALIDATIONS = Counter(
+    "lookup_cache_invalidations_total",
+    "Lookup cache entries dropped because the caller submitted a claim",
+)
+
+# Request coalescing
+COALESCED_CALLS = Counter(
+    "coalesced_calls_total",
+    "Calls through a single-flight group, shared ones were served by another caller's in-flight request",
+    ["operation", "result"],
+)
+
+# Speculative retrieval
+SPECULATIVE_RETRIEVALS = Counter(
+    "speculative_retrievals_total",
+    "Retrievals started while the router was deciding, by whether the knowledge node used them",
+    ["result"],
+)
+SPECULATIVE_RETRIEVAL_SAVED_SECONDS = Counter(
+    "speculative_retrieval_saved_seconds_total",
+    "Retrieval time hidden behind the routing decision",
+)
+SPECULATIVE_RETRIEVAL_WASTED_SECONDS = Counter(
+    "speculative_retrieval_wasted_seconds_total",
+    "Retrieval time spent on speculations that were discarded",
+)
@@ -1,17 +1,34 @@
+import hashlib
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import OpenAIEmbeddings
-from langchain_postgres import PGVector
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from util.document_store import create_document_store
+from util.embedding_cache import get_cached_embeddings, normalize_text
+
+logger = logging.getLogger(__name__)
+
 
 class PdfDocumentEmbedder:
-    def __init__(self,file_path:str,chuck_size:int=1000,chunk_overlap:int=200):
+    """Streams a PDF through parse -> split -> embed -> insert, parsing every page exactly once"""
+
+    def __init__(self,file_path:str,chuck_size:int=1000,chunk_overlap:int=200,
+                 batch_size:Optional[int]=None,embed_concurrency:Optional[int]=None):
         load_dotenv()
         self.filepath = file_path
         self.database_url= getenv("KNOWLEDGE_DB_URL")
+        # chunks per embedding request / insert statement
+        self.batch_size = batch_size or int(getenv("INGEST_BATCH_SIZE", "64"))
+        # embedding requests in flight, also bounds how many batches are held in memory
+        self.embed_concurrency = embed_concurrency or int(getenv("INGEST_EMBED_CONCURRENCY", "4"))
         self.loader = PyPDFLoader(self.filepath)
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chuck_size,
@@ -19,16 +36,110 @@ class PdfDocumentEmbedder:
             length_function=len,
             separators=["\n\n", "\n", " ", ""]
         )
-        # for doc in loaded:
-        #     print(doc.page_content)
-        docks = self.loader.load_and_split(self.text_splitter)
-
-    def insert_into_db(self,collection_name:str):
-        docks = self.loader.load_and_split(self.text_splitter)
-        vector_store = PGVector.from_documents(
-            embedding=OpenAIEmbeddings(),
-            collection_name=collection_name,
-            documents=docks,
-            connection=self.database_url,
-            use_jsonb=True,
-        )
\ No newline at end of file
+        self.pages = 0
+        self.chunks = 0
+
+    def iter_chunks(self, on_progress: Optional[Callable[[str, int], None]] = None) -> Iterator[Document]:
+        """Lazily parse pages and split each one as soon as it is read"""
+        for page in self.loader.lazy_load():
+            self.pages += 1
+            if on_progress:
+                on_progress("pages_parsed", 1)
+            for chunk in self.text_splitter.split_documents([page]):
+                self.chunks += 1
+                yield chunk
+
+    def file_hash(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.filepath, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def chunk_id(collection_name: str, document_key: str, text: str, occurrence: int) -> str:
+        """Deterministic id so an unchanged chunk maps to the same row across uploads"""
+        raw = "\0".join([collection_name, document_key, normalize_text(text), str(occurrence)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def insert_into_db(self,collection_name:str, on_progress: Optional[Callable[[str, int], None]] = None,
+                       document_key: Optional[str] = None) -> Dict[str, Any]:
+        """Incrementally index the PDF under document_key, reporting each stage through on_progress(stage, count).
+
+        Chunks already indexed for the document are skipped, new chunks are embedded and inserted and
+        chunks no longer present are deleted, so the cost of a re-upload scales with the size of the edit.
+        Embedding requests for upcoming batches run concurrently while finished batches are inserted,
+        and at most embed_concurrency batches are held in memory at any time.
+        """
+        def report(stage: str, count: int):
+            if on_progress:
+                on_progress(stage, count)
+
+        def embed(batch: List[Document]):
+            vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+            report("chunks_embedded", len(batch))
+            return batch, vectors
+
+        def insert(batch: List[Document], vectors: List[List[float]]):
+            document_store.add(
+                [doc.page_content for doc in batch],
+                vectors,
+                metadatas=[doc.metadata for doc in batch],
+                ids=[doc.id for doc in batch],
+            )
+            report("rows_written", len(batch))
+
+        def new_chunks() -> Iterator[List[Document]]:
+            occurrences = {}
+            batch = []
+            for chunk in self.iter_chunks(report):
+                text_key = normalize_text(chunk.page_content)
+                occurrences[text_key] = occurrences.get(text_key, 0) + 1
+                chunk.id = self.chunk_id(collection_name, document_key, chunk.page_content, occurrences[text_key])
+                seen.add(chunk.id)
+                if chunk.id in existing:
+                    report("chunks_unchanged", 1)
+                    continue
+                chunk.metadata.update({"document_key": document_key, "document_hash": document_hash})
+                batch.append(chunk)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        self.pages = 0
+        self.chunks = 0
+        document_key = document_key or os.path.basename(self.filepath)
+        document_hash = self.file_hash()
+        embeddings = get_cached_embeddings()
+        document_store = create_document_store(collection_name, self.database_url, embeddings)
+
+        with document_store:
+
+            existing = document_store.document_chunks(document_key)
+            if existing and all(h == document_hash for h in existing.values()):
+                logger.info(f"Document {document_key} is unchanged, skipping ingestion")
+                return {"document_key": document_key, "document_hash": document_hash, "unchanged": True,
+                        "pages": None, "chunks": len(existing), "chunks_added": 0, "chunks_deleted": 0}
+
+            seen = set()
+            added = 0
+            in_flight = deque()
+            with ThreadPoolExecutor(max_workers=self.embed_concurrency) as executor:
+                for batch in new_chunks():
+                    added += len(batch)
+                    in_flight.append(executor.submit(embed, batch))
+                    if len(in_flight) >= self.embed_concurrency:
+                        insert(*in_flight.popleft().result())
+                while in_flight:
+                    insert(*in_flight.popleft().result())
+
+            stale = [chunk_id for chunk_id in existing if chunk_id not in seen]
+            for start in range(0, len(stale), self.batch_size):
+                document_store.delete(stale[start:start + self.batch_size])
+                report("rows_deleted", len(stale[start:start + self.batch_size]))
+            document_store.set_document_hash(document_key, document_hash)
+
+        return {"document_key": document_key, "document_hash": document_hash, "unchanged": False,
+                "pages": self.pages, "chunks": self.chunks, "chunks_added": added, "chunks_deleted": len(stale)}
@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from os import getenv
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# JWTs and bearer credentials users sometimes paste into a message
+SECRET_PATTERN = re.compile(r"\beyJ[\w-]+\.[\w-]+\.[\w-]+|\bBearer\s+\S+", re.I)
+
+
+def scrub_secrets(text: str) -> str:
+    return SECRET_PATTERN.sub("[redacted]", text)
+
+
+def pseudonymize(value: str) -> str:
+    """Stable stand-in for an id, the same session keeps the same pseudonym across requests"""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+class SessionRecorder:
+    """Appends every chat request to a JSONL replay file.
+
+    Auth tokens are never written and user/session ids are pseudonymized, the message text and the
+    timing between turns are kept so benchmarks/replay_sessions.py can reissue the same load.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else getenv("SESSION_RECORD_PATH", "")
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _append(self, line: str):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    async def record(self, endpoint: str, session_id: str, user_id: str, role: str, message: str,
+                     started_at: float, latency: float, status: str = "ok"):
+        if not self.enabled:
+            return
+        line = json.dumps({
+            "ts": round(started_at, 3),
+            "endpoint": endpoint,
+            "session": pseudonymize(session_id),
+            "user": pseudonymize(user_id),
+            "role": role,
+            "message": scrub_secrets(message),
+            "latency_ms": round(latency * 1000, 1),
+            "status": status,
+        })
+        try:
+            await asyncio.to_thread(self._append, line)
+        except Exception as e:
+            logger.error(f"Error recording chat request: {e}")
@@ -0,0 +1,39 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from util.metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    """Collapses concurrent identical calls into one upstream call.
+
+    The first caller for a key starts the call as a task, callers arriving while it is in flight
+    await the same task and get its result (or exception). Nothing is kept once it finishes, this
+    is not a cache. A caller that is cancelled or times out does not cancel the call for the others.
+    """
+
+    def __init__(self, operation: str, copy_result: bool = False):
+        self.operation = operation
+        # give every caller its own copy when callers may mutate the result
+        self.copy_result = copy_result
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # consumed here so a call every waiter gave up on is not reported as unretrieved
+            task.exception()
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            COALESCED_CALLS.labels(operation=self.operation, result="upstream").inc()
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            COALESCED_CALLS.labels(operation=self.operation, result="shared").inc()
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result) if self.copy_result else result
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+from os import getenv
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.tools import BaseTool
+
+from util.instrumentation import timed
+from util.metrics import ERRORS, TOOL_CALL_SECONDS
+from util.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class ToolExecutor:
+    """Runs the tool calls requested in one model turn.
+
+    Read-only calls run concurrently, so a multi-lookup turn takes as long as its slowest call, and
+    are bounded by the timeout. Calls with side effects run one at a time in the order the model asked
+    for them and are never cancelled, a write abandoned halfway could still land and be repeated on
+    retry. on_result receives each call and its result as soon as the call finishes.
+    """
+
+    def __init__(self, tools: Iterable[BaseTool], side_effecting: Iterable[str] = (), timeout: Optional[float] = None):
+        self.tools: Dict[str, BaseTool] = {tool.name: tool for tool in tools}
+        self.side_effecting = set(side_effecting)
+        self.timeout = timeout or float(getenv("TOOL_CALL_TIMEOUT", "10"))
+
+    async def _call(self, tool_call: Dict[str, Any], extra_args: Dict[str, Any]) -> Any:
+        tool_name = tool_call["name"]
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            logger.warning(f"Model requested unknown tool {tool_name}")
+            return {"error": f"Unknown tool {tool_name}"}
+        timeout = None if tool_name in self.side_effecting else self.timeout
+        try:
+            with timed(TOOL_CALL_SECONDS, tool=tool_name), span(f"tool {tool_name}") as tool_span:
+                result = await asyncio.wait_for(tool.ainvoke({**tool_call["args"], **extra_args}), timeout)
+                if tool_span.recording:
+                    tool_span.set(result_bytes=len(json.dumps(result, default=str)))
+            return result
+        except asyncio.TimeoutError:
+            logger.error(f"Tool {tool_name} timed out after {self.timeout}s")
+            ERRORS.labels(component="tool").inc()
+            return {"error": f"{tool_name} did not respond within {self.timeout:g} seconds"}
+        except Exception as e:
+            logger.error(f"Tool execution error: {e}")
+            ERRORS.labels(component="tool").inc()
+            return {"error": f"Could not retrieve required data: {str(e)}"}
+
+    async def run(self, tool_calls: List[Dict[str, Any]], on_result: Callable[[Dict[str, Any], Any], None],
+                  **extra_args) -> Dict[str, Any]:
+        """Execute tool_calls with extra_args (e.g. the auth token) added to each, returns results by tool call id"""
+        results: Dict[str, Any] = {}
+
+        async def run_one(index, tool_call):
+            result = await self._call(tool_call, extra_args)
+            results[tool_call.get("id") or f"{tool_call['name']}-{index}"] = result
+            on_result(tool_call, result)
+
+        async def run_serialized(calls):
+            for index, tool_call in calls:
+                await run_one(index, tool_call)
+
+        read_only = [(i, call) for i, call in enumerate(tool_calls) if call["name"] not in self.side_effecting]
+        side_effecting = [(i, call) for i, call in enumerate(tool_calls) if call["name"] in self.side_effecting]
+        await asyncio.gather(*(run_one(i, call) for i, call in read_only), run_serialized(side_effecting))
+        return results
@@ -0,0 +1,228 @@
+import importlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """One timed operation of a trace, attributes carry sizes and other details"""
+    recording = True
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, status: Optional[str] = None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        if status:
+            self.status = status
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when the request is not sampled"""
+    recording = False
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, status: Optional[str] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, name: str, session_id: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.session_id = session_id
+        self.spans: List[Span] = []
+
+    def to_dict(self, root: Span) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "name": self.name,
+            "start": root.started_at,
+            "duration_ms": round(root.duration_ms or 0, 3),
+            "spans": [span.to_dict() for span in sorted(self.spans, key=lambda s: s.started_at)],
+        }
+
+
+class TraceExporter(ABC):
+    """Receives every finished, sampled trace. Subclass and point TRACE_EXPORTER at it to ship traces elsewhere"""
+
+    @abstractmethod
+    def export(self, trace: Dict[str, Any]):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class JsonlTraceExporter(TraceExporter):
+    """Appends one JSON line per trace, written by a background thread so requests never wait on disk"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or getenv("TRACE_PATH", ".cache/traces.jsonl")
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _write_loop(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            trace = self._queue.get()
+            if trace is None:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace, default=str) + "\n")
+            except Exception as e:
+                logger.error(f"Error writing trace to {self.path}: {e}")
+
+    def export(self, trace: Dict[str, Any]):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+                self._thread.start()
+        self._queue.put(trace)
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Per request tracing keyed by session id.
+
+    A trace is started for sample_rate of the requests (TRACE_SAMPLE_RATE, 0 disables tracing),
+    spans opened while no sampled trace is active cost a context variable lookup and nothing else.
+    """
+
+    def __init__(self, exporter: Optional[TraceExporter] = None, sample_rate: Optional[float] = None):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if sample_rate is not None else float(getenv("TRACE_SAMPLE_RATE", "0"))
+
+    @contextmanager
+    def trace(self, name: str, session_id: str, **attributes):
+        if self.exporter is None or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield NOOP_SPAN
+            return
+        root = Span(Trace(name, session_id), name, None, attributes)
+        token = _current_span.set(root)
+        status = "error"
+        try:
+            yield root
+            status = "ok"
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # a streaming generator closed from another context, nothing left to restore
+                pass
+            root.end(status)
+            try:
+                self.exporter.export(root.trace.to_dict(root))
+            except Exception as e:
+                logger.error(f"Error exporting trace: {e}")
+
+    @staticmethod
+    def start_span(name: str, **attributes):
+        """Start a child of the active span without activating it, end it with span.end()"""
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, **attributes)
+        if not span.recording:
+            yield span
+            return
+        token = _current_span.set(span)
+        status = "error"
+        try:
+            yield span
+            status = "ok"
+        finally:
+            _current_span.reset(token)
+            span.end(status)
+
+
+def _create_exporter() -> Optional[TraceExporter]:
+    name = getenv("TRACE_EXPORTER", "jsonl")
+    if name == "none":
+        return None
+    if name == "jsonl":
+        return JsonlTraceExporter()
+    # "package.module:ClassName" of a TraceExporter subclass
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(exporter=_create_exporter())
+    return _tracer
+
+
+def shutdown_tracer():
+    """Flush traces still queued for export, called on application shutdown"""
+    if _tracer is not None and _tracer.exporter is not None:
+        _tracer.exporter.shutdown()
+
+
+def span(name: str, **attributes):
+    """Child span of the active trace, a no-op outside a sampled request"""
+    return get_tracer().span(name, **attributes)
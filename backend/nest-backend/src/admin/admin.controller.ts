@@ -53,11 +53,12 @@ export class AdminController {
       }),
   )
   async uploadDocument(@UploadedFile() file: Express.Multer.File, @Body('description') description?: string,
+                       @Body('documentKey') documentKey?: string,
   ) {
     if (!file) {
       throw new HttpException('No file uploaded', HttpStatus.BAD_REQUEST);
     }
 
-    return this.adminService.uploadDocument(file, description);
+    return this.adminService.uploadDocument(file, description, documentKey);
   }
 }
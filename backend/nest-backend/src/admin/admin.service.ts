@@ -12,7 +12,7 @@ export class AdminService {
         this.aiServiceUrl = this.configService.get<string>('AI_SERVICE_URL', 'http://127.0.0.1:8000');
     }
 
-    async uploadDocument(file: Express.Multer.File, description?: string) {
+    async uploadDocument(file: Express.Multer.File, description?: string, documentKey?: string) {
         try {
             // Ensure uploads directory exists
             await this.ensureUploadsDirectory();
@@ -25,6 +25,8 @@ export class AdminService {
                 size: file.size,
                 mimetype: file.mimetype,
                 description: description || '',
+                // a corrected version uploaded under the same key replaces the previous one in the knowledge base
+                documentKey: documentKey || file.originalname,
                 uploadedAt: new Date().toISOString(),
             };
 
@@ -62,9 +64,10 @@ export class AdminService {
 
             const formData = new FormData();
             formData.append('file', fs.createReadStream(fileInfo.path), {
-                filename: fileInfo.originalname,
+                filename: fileInfo.originalName,
                 contentType: fileInfo.mimetype
             });
+            formData.append('document_key', fileInfo.documentKey);
 
             const response = await axios.post(`${this.aiServiceUrl}/upload-document`, formData, {
                 headers: {
@@ -7,4 +7,10 @@ export class UploadFileDto {
         description: 'The file to upload',
     })
     file: any;
+
+    @ApiProperty({
+        required: false,
+        description: 'Stable key of the document, re-uploading under the same key replaces its previous version. Defaults to the file name',
+    })
+    documentKey?: string;
 }